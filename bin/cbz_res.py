@@ -1,24 +1,37 @@
 #!/usr/bin/env -S uv run
 # /// script
-# requires-python = ">=3.8"
+# requires-python = ">=3.10"
 # dependencies = [
 #     "numpy",
 #     "pillow",
+#     "py7zr>=1.0",
+#     "rarfile",
 #     "scikit-learn",
 # ]
 # ///
 
 import argparse
 import collections
+import concurrent.futures
 import functools
+import io
 import json
+import mmap
 import operator
+import os
 import pathlib
+import struct
+import sys
+import tarfile
+import time
 import warnings
 import zipfile
-from typing import List, Sequence, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
+import py7zr
+import rarfile
+from py7zr.io import BytesIOFactory
 from PIL import ImageFile
 from sklearn.cluster import KMeans
 from sklearn.exceptions import ConvergenceWarning
@@ -65,50 +78,603 @@ def compute_kmeans(sizes: List[Res], n_clust: int = 3) -> ResProb:
     return res, prob
 
 
+def _jpeg_size(data: bytes) -> Optional[Res]:
+    # Walk the marker segments up to the first start-of-frame, which holds the size.
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker.
+            pos += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            # Markers without a length.
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan before any frame header.
+            return None
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if pos + 9 > len(data):
+                return None
+            height, width = struct.unpack_from(">HH", data, pos + 5)
+            return width, height
+        pos += 2 + struct.unpack_from(">H", data, pos + 2)[0]
+    return None
+
+
+def _png_size(data: bytes) -> Optional[Res]:
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        return None
+    return struct.unpack_from(">II", data, 16)
+
+
+def _gif_size(data: bytes) -> Optional[Res]:
+    if len(data) < 10:
+        return None
+    return struct.unpack_from("<HH", data, 6)
+
+
+def _bmp_size(data: bytes) -> Optional[Res]:
+    if len(data) < 26:
+        return None
+    if struct.unpack_from("<I", data, 14)[0] == 12:
+        # OS/2 BITMAPCOREHEADER, with 16-bit dimensions.
+        return struct.unpack_from("<HH", data, 18)
+    width, height = struct.unpack_from("<ii", data, 18)
+    # A negative height marks a top-down bitmap.
+    return width, abs(height)
+
+
+def _webp_size(data: bytes) -> Optional[Res]:
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        # Lossy: 14-bit dimensions after the key frame start code.
+        if data[23:26] != b"\x9d\x01\x2a":
+            return None
+        width, height = struct.unpack_from("<HH", data, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        # Lossless: 14-bit dimensions minus one, packed after the signature byte.
+        if data[20] != 0x2F:
+            return None
+        bits = struct.unpack_from("<I", data, 21)[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        # Extended: 24-bit canvas dimensions minus one.
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def _iter_boxes(data: bytes, start: int, end: int):
+    """Yield (type, payload start, box end) for the ISO BMFF boxes in data[start:end]."""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _find_boxes(data: bytes, start: int, end: int, path: Sequence[bytes]):
+    """Yield (payload start, end) of the boxes at the end of path, e.g. (b"meta", b"iprp")."""
+    for kind, box_start, box_end in _iter_boxes(data, start, end):
+        if kind != path[0]:
+            continue
+        if kind == b"meta":
+            # A full box: skip its version and flags.
+            box_start += 4
+        if len(path) == 1:
+            yield box_start, box_end
+        else:
+            yield from _find_boxes(data, box_start, box_end, path[1:])
+
+
+def _heif_size(data: bytes) -> Optional[Res]:
+    # Thumbnails and grid tiles have their own ispe, so the largest one is taken as the
+    # primary image's size.
+    sizes = [
+        struct.unpack_from(">II", data, start + 4)
+        for start, end in _find_boxes(
+            data, 0, len(data), (b"meta", b"iprp", b"ipco", b"ispe")
+        )
+        if end - start >= 12
+    ]
+    return max(sizes, key=lambda size: size[0] * size[1], default=None)
+
+
+# (signature test, parser) for the formats whose size is read without PIL. A parser
+# returns None when it needs more data than it was given.
+HEADER_PARSERS: List[
+    Tuple[Callable[[bytes], bool], Callable[[bytes], Optional[Res]]]
+] = [
+    (lambda data: data[:2] == b"\xff\xd8", _jpeg_size),
+    (lambda data: data[:8] == b"\x89PNG\r\n\x1a\n", _png_size),
+    (lambda data: data[:4] == b"RIFF" and data[8:12] == b"WEBP", _webp_size),
+    (lambda data: data[:6] in (b"GIF87a", b"GIF89a"), _gif_size),
+    (lambda data: data[:2] == b"BM", _bmp_size),
+    (
+        lambda data: (
+            data[4:8] == b"ftyp"
+            and data[8:12] in (b"avif", b"avis", b"heic", b"heix", b"mif1", b"msf1")
+        ),
+        _heif_size,
+    ),
+]
+
+# Bytes read before the first parse attempt; the read size doubles from there.
+HEADER_CHUNK_SIZE = 4096
+
+
+def pil_image_size(read: Callable[[int], bytes], data: bytes = b"") -> Res:
+    """Feed a PIL parser until it knows the image size."""
+    chunk_size = 2048
+    parser = ImageFile.Parser()
+    chunk = data or read(chunk_size)
+    while chunk:
+        parser.feed(chunk)
+        if parser.image:
+            return parser.image.size
+        chunk = read(chunk_size)
+    raise ValueError("could not read the image header")
+
+
+def image_size(read: Callable[[int], bytes]) -> Res:
+    """
+    Size of the image read from read(n), using the native header parsers and reading
+    as little as possible, or PIL for other formats and headers they can't make sense of.
+    """
+    data = read(HEADER_CHUNK_SIZE)
+    parse = next((parse for matches, parse in HEADER_PARSERS if matches(data)), None)
+    if parse is None:
+        return pil_image_size(read, data)
+    while True:
+        size = parse(data)
+        if size is not None and size[0] > 0 and size[1] > 0:
+            return size[0], size[1]
+        more = read(len(data))
+        if not more:
+            return pil_image_size(read, data)
+        data += more
+
+
+def _stored_reader(archive: mmap.mmap, info: zipfile.ZipInfo) -> Callable[[int], bytes]:
+    """read(n) over a stored zip member's bytes, straight from the mapped archive."""
+    header = archive[info.header_offset : info.header_offset + zipfile.sizeFileHeader]
+    *_, name_length, extra_length = struct.unpack(zipfile.structFileHeader, header)
+    pos = info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+    end = pos + info.compress_size
+
+    def read(size: int) -> bytes:
+        nonlocal pos
+        chunk = archive[pos : min(pos + size, end)]
+        pos += len(chunk)
+        return chunk
+
+    return read
+
+
+class ReadCounter:
+    """Totals the bytes returned by the read(n) functions it wraps."""
+
+    def __init__(self) -> None:
+        self.total = 0
+
+    def wrap(self, read: Callable[[int], bytes]) -> Callable[[int], bytes]:
+        def counted(size: int) -> bytes:
+            chunk = read(size)
+            self.total += len(chunk)
+            return chunk
+
+        return counted
+
+
+def member_image_size(name: str, read: Callable[[int], bytes]) -> Res:
+    try:
+        return image_size(read)
+    except ValueError as e:
+        raise ValueError(f"{name}: {e}") from e
+
+
 def img_sizes_from_header(
-    zf: zipfile.ZipFile, filelist: Sequence[ZipInput]
+    zf: zipfile.ZipFile,
+    filelist: Sequence[ZipInput],
+    native: bool = True,
+    counter: Optional[ReadCounter] = None,
 ) -> List[Res]:
-    chunk_size = 2048
+    """
+    Image sizes of the given members, from their headers. Stored members are read
+    through a memory map of the archive when possible; native=False always goes through
+    zf.open and PIL's parser. Bytes read from compressed members are added to counter.
+    """
+    archive = None
+    if native:
+        try:
+            archive = mmap.mmap(zf.fp.fileno(), 0, access=mmap.ACCESS_READ)  # type: ignore
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            # Not backed by a regular file.
+            archive = None
     res = []
-    for file in filelist:
-        with zf.open(file, mode="r") as zext:
-            parser = ImageFile.Parser()
-            chunk = zext.read(chunk_size)
-            count = 2048
-            while chunk != "":
-                parser.feed(chunk)
-                if parser.image:
-                    break
-                chunk = zext.read(chunk_size)
-                count += chunk_size
-            res.append(parser.image.size)  # type: ignore
+    try:
+        for file in filelist:
+            info = file if isinstance(file, zipfile.ZipInfo) else zf.getinfo(file)
+            try:
+                if not native:
+                    with zf.open(info, mode="r") as zext:
+                        res.append(pil_image_size(zext.read))
+                elif (
+                    archive is not None
+                    and info.compress_type == zipfile.ZIP_STORED
+                    and not info.flag_bits & 0x1
+                ):
+                    res.append(image_size(_stored_reader(archive, info)))
+                else:
+                    with zf.open(info, mode="r") as zext:
+                        read = zext.read
+                        if (
+                            counter is not None
+                            and info.compress_type != zipfile.ZIP_STORED
+                        ):
+                            read = counter.wrap(read)
+                        res.append(image_size(read))
+            except ValueError as e:
+                raise ValueError(f"{info.filename}: {e}") from e
+    finally:
+        if archive is not None:
+            archive.close()
     return res
 
 
-def get_image_sizes(zip_file: pathlib.Path, samples: int = 20) -> dict:
-    assert zip_file.exists(), f"file {zip_file} does not exist"
-    with zipfile.ZipFile(zip_file) as zf:
-        namelist = [
-            i
-            for i in zf.namelist()
-            if any(map(i.endswith, [".jpg", ".jpeg", ".png", ".tiff", ".webp", ".bmp"]))
+IMAGE_EXTENSIONS = (
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".tiff",
+    ".webp",
+    ".bmp",
+    ".gif",
+    ".avif",
+    ".heic",
+    ".heif",
+)
+
+
+def is_image_name(name: str) -> bool:
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def image_names(zf: zipfile.ZipFile) -> List[str]:
+    return [i for i in zf.namelist() if is_image_name(i)]
+
+
+def random_sample(names: Sequence[str], samples: int) -> List[str]:
+    """samples of names picked at random, or all of them when samples <= 0."""
+    if samples <= 0 or samples >= len(names):
+        return list(names)
+    return list(np.random.choice(names, size=samples, replace=False))
+
+
+def solid_sample(blocks: Sequence[Sequence[str]], samples: int) -> List[str]:
+    """
+    Sample a solid archive, given its members grouped by solid block in archive order.
+    Reaching a member means decompressing its block from the start, so the first member
+    of every block is taken, then the second, and so on. Returned in archive order.
+    """
+    ranked = sorted(
+        (depth, index, name)
+        for index, block in enumerate(blocks)
+        for depth, name in enumerate(block)
+    )
+    if samples > 0:
+        ranked = ranked[:samples]
+    return [name for *_, name in sorted(ranked, key=operator.itemgetter(1, 0))]
+
+
+# Every reader returns the sampled sizes, the page count (None when counting would mean
+# decompressing the whole archive), whether the archive is solid and the bytes it had
+# to decompress.
+
+
+def zip_image_sizes(file: pathlib.Path, samples: int) -> Dict[str, Any]:
+    with zipfile.ZipFile(file) as zf:
+        namelist = image_names(zf)
+        counter = ReadCounter()
+        sizes = img_sizes_from_header(
+            zf, random_sample(namelist, samples), counter=counter
+        )
+    return {
+        "sizes": sizes,
+        "n": len(namelist),
+        "solid": False,
+        "decompressed": counter.total,
+    }
+
+
+def rar_image_sizes(file: pathlib.Path, samples: int) -> Dict[str, Any]:
+    with rarfile.RarFile(file) as rf:
+        infos = [info for info in rf.infolist() if not info.is_dir()]
+        namelist = [info.filename for info in infos if is_image_name(info.filename)]
+        solid = rf.is_solid()
+        # In a solid rar, each member is extracted by decompressing everything before it.
+        preceding = {}
+        offset = 0
+        for info in infos:
+            preceding[info.filename] = offset if solid else 0
+            offset += info.file_size
+        if solid:
+            choices = solid_sample([namelist], samples)
+        else:
+            choices = random_sample(namelist, samples)
+        counter = ReadCounter()
+        sizes = []
+        for name in choices:
+            info = rf.getinfo(name)
+            counter.total += preceding[name]
+            with rf.open(info) as fp:
+                read = fp.read
+                if info.compress_type != rarfile.RAR_M0:
+                    read = counter.wrap(read)
+                sizes.append(member_image_size(name, read))
+    return {
+        "sizes": sizes,
+        "n": len(namelist),
+        "solid": solid,
+        "decompressed": counter.total,
+    }
+
+
+# Bytes kept of each extracted 7z member; py7zr still decompresses the whole member.
+SEVEN_ZIP_HEAD_LIMIT = 1 << 20
+
+
+def seven_zip_image_sizes(file: pathlib.Path, samples: int) -> Dict[str, Any]:
+    with py7zr.SevenZipFile(file, mode="r") as sz:
+        # Members in archive order, grouped by the folder (solid block) holding them.
+        blocks: Dict[int, List[Any]] = {}
+        for member in sz.files:
+            if not member.is_directory and not member.emptystream:
+                blocks.setdefault(id(member.folder), []).append(member)
+        block_names = [
+            [member.filename for member in block if is_image_name(member.filename)]
+            for block in blocks.values()
         ]
+        namelist = [name for names in block_names for name in names]
+        solid = any(len(block) > 1 for block in blocks.values())
+        if solid:
+            choices = solid_sample(block_names, samples)
+        else:
+            choices = random_sample(namelist, samples)
+        factory = BytesIOFactory(SEVEN_ZIP_HEAD_LIMIT)
+        if choices:
+            sz.extract(targets=choices, factory=factory)
+    sizes = []
+    for name in choices:
+        head = factory.get(name)
+        head.seek(0)
+        sizes.append(member_image_size(name, head.read))
+    # py7zr decompresses each block it needs up to the last member taken from it.
+    chosen = set(choices)
+    decompressed = 0
+    for block in blocks.values():
+        last = max(
+            (i for i, member in enumerate(block) if member.filename in chosen),
+            default=-1,
+        )
+        decompressed += sum(member.uncompressed for member in block[: last + 1])
+    return {
+        "sizes": sizes,
+        "n": len(namelist),
+        "solid": solid,
+        "decompressed": decompressed,
+    }
+
+
+# Leading bytes of the compressed tar streams tarfile can open.
+COMPRESSED_TAR_MAGIC = (b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")
 
-        if samples <= 0:
-            total_samples = len(namelist)
-            choices = namelist
+
+def tar_image_sizes(file: pathlib.Path, samples: int) -> Dict[str, Any]:
+    with open(file, "rb") as fp:
+        solid = fp.read(6).startswith(COMPRESSED_TAR_MAGIC)
+    sizes = []
+    with tarfile.open(file, "r:*") as tf:
+        if not solid:
+            # Listing an uncompressed tar only seeks from header to header.
+            members = {
+                member.name: member
+                for member in tf.getmembers()
+                if member.isfile() and is_image_name(member.name)
+            }
+            for name in random_sample(list(members), samples):
+                with tf.extractfile(members[name]) as fp:  # type: ignore
+                    sizes.append(member_image_size(name, fp.read))
+            return {
+                "sizes": sizes,
+                "n": len(members),
+                "solid": False,
+                "decompressed": 0,
+            }
+        # A compressed tar is one stream with the headers inside it, so pages are taken
+        # from the front and the listing stops once the sample is full.
+        n: Optional[int] = None
+        for member in tf:
+            if not (member.isfile() and is_image_name(member.name)):
+                continue
+            with tf.extractfile(member) as fp:  # type: ignore
+                sizes.append(member_image_size(member.name, fp.read))
+            if len(sizes) == samples:
+                break
         else:
-            total_samples = len(namelist) if samples > len(namelist) else samples
-            choices = list(
-                np.random.choice(namelist, size=total_samples, replace=False)
-            )
+            n = len(sizes)
+        decompressed = tf.fileobj.tell()  # type: ignore
+    return {"sizes": sizes, "n": n, "solid": True, "decompressed": decompressed}
+
+
+def dir_image_sizes(file: pathlib.Path, samples: int) -> Dict[str, Any]:
+    # Pages only come from the top level of a directory.
+    namelist = sorted(
+        path.name
+        for path in file.iterdir()
+        if path.is_file() and is_image_name(path.name)
+    )
+    sizes = []
+    for name in random_sample(namelist, samples):
+        with open(file / name, "rb") as fp:
+            sizes.append(member_image_size(name, fp.read))
+    return {"sizes": sizes, "n": len(namelist), "solid": False, "decompressed": 0}
+
+
+# Readers by suffix, for the formats comic_book.py reads; "/" is a directory of pages.
+READERS: Dict[str, Callable[[pathlib.Path, int], Dict[str, Any]]] = {
+    ".cbz": zip_image_sizes,
+    ".zip": zip_image_sizes,
+    ".cbr": rar_image_sizes,
+    ".rar": rar_image_sizes,
+    ".cb7": seven_zip_image_sizes,
+    ".7z": seven_zip_image_sizes,
+    ".cbt": tar_image_sizes,
+    ".tar": tar_image_sizes,
+    "/": dir_image_sizes,
+}
+
+
+def file_format(file: pathlib.Path) -> str:
+    return "/" if file.is_dir() else file.suffix.lower()
+
+
+def get_image_sizes(file: pathlib.Path, samples: int = 20) -> dict:
+    assert file.exists(), f"file {file} does not exist"
+    reader = READERS.get(file_format(file))
+    if reader is None:
+        raise ValueError(f"unsupported file type {file.suffix!r}")
+    return reader(file, samples)
+
+
+METRICS = {
+    "count": compute_count,
+    "average": compute_average,
+    "min": functools.partial(compute_min_max, operation=min),
+    "max": functools.partial(compute_min_max, operation=max),
+    "kmeans": compute_kmeans,
+}
 
-        return {"sizes": img_sizes_from_header(zf, choices), "n": len(namelist)}
+
+def scan_file(
+    file: pathlib.Path, samples: int, metric: str, n_clust: int
+) -> Dict[str, Any]:
+    """
+    Resolution record for one archive. Every record has the same fields; a file that
+    can't be read gets an error message and nulls instead of aborting the scan.
+    """
+    record: Dict[str, Any] = {
+        "file": str(file),
+        "format": "dir" if file_format(file) == "/" else file_format(file).lstrip("."),
+        "metric": metric,
+        "resolution": None,
+        "width": None,
+        "height": None,
+        "n": 0,
+        "pages": None,
+        "prob": None,
+        "solid": None,
+        "decompressed": None,
+        "error": None,
+    }
+    try:
+        img_sizes = get_image_sizes(file, samples=samples)
+        if not img_sizes["sizes"]:
+            raise ValueError("no images found")
+        metric_func = METRICS[metric]
+        if metric == "kmeans":
+            metric_func = functools.partial(compute_kmeans, n_clust=n_clust)
+        res, prob = metric_func(img_sizes["sizes"])
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    record.update(
+        resolution=f"{res[0]}x{res[1]}",
+        width=int(res[0]),
+        height=int(res[1]),
+        n=len(img_sizes["sizes"]),
+        pages=img_sizes["n"],
+        prob=f"{prob:.2%}",
+        solid=img_sizes["solid"],
+        decompressed=img_sizes["decompressed"],
+    )
+    return record
+
+
+# Runs per parser in --benchmark; the fastest is reported.
+BENCHMARK_REPEAT = 5
+
+
+def benchmark_file(file: pathlib.Path) -> Dict[str, Any]:
+    """
+    Time probing every page of a zip archive with the native parsers and with PIL's.
+    Like scan_file, a file that can't be benchmarked gets an error and nulls.
+    """
+    record: Dict[str, Any] = {
+        "file": str(file),
+        "pages": None,
+        "native_ms": None,
+        "pil_ms": None,
+        "speedup": None,
+        "mismatches": None,
+        "error": None,
+    }
+    try:
+        if READERS.get(file_format(file)) is not zip_image_sizes:
+            raise ValueError("only cbz/zip archives can be benchmarked")
+        with zipfile.ZipFile(file) as zf:
+            names = image_names(zf)
+            timings = {}
+            sizes = {}
+            for native in (True, False):
+                best = float("inf")
+                for _ in range(BENCHMARK_REPEAT):
+                    start = time.perf_counter()
+                    sizes[native] = img_sizes_from_header(zf, names, native=native)
+                    best = min(best, time.perf_counter() - start)
+                timings[native] = best
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    record.update(
+        pages=len(names),
+        native_ms=round(timings[True] * 1000, 3),
+        pil_ms=round(timings[False] * 1000, 3),
+        speedup=round(timings[False] / timings[True], 1) if timings[True] else None,
+        mismatches=sum(map(operator.ne, sizes[True], sizes[False])),
+    )
+    return record
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
 
 
 def cli(metrics: dict) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
-        description="Get the resolution of images inside cbz files"
+        description="Get the resolution of images inside comic archives"
     )
     parser.add_argument(
         "-s", "--samples", default=10, type=int, help="number of images to sample"
@@ -129,51 +695,83 @@ def cli(metrics: dict) -> argparse.Namespace:
         help="number of clusters when using kmeans",
     )
     parser.add_argument(
-        "-j", "--json", action="store_true", help="output in json format"
+        "-j",
+        "--json",
+        action="store_true",
+        help="output one json object per line (json lines)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=os.cpu_count() or 1,
+        type=int,
+        help="number of files to scan in parallel",
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        action="store_true",
+        help="time reading every page's size in cbz files with the native parsers against PIL",
+    )
+    parser.add_argument(
+        "files",
+        nargs="+",
+        type=pathlib.Path,
+        help="cbz, cbr, cb7 or cbt files, or directories of images",
     )
-    parser.add_argument("files", nargs="+", type=pathlib.Path, help="cbz files")
     return parser.parse_args()
 
 
-def main():
-    metrics = {
-        "count": compute_count,
-        "average": compute_average,
-        "min": functools.partial(compute_min_max, operation=min),
-        "max": functools.partial(compute_min_max, operation=max),
-        "kmeans": compute_kmeans,
-    }
-    args = cli(metrics)
-    metrics["kmeans"] = functools.partial(compute_kmeans, n_clust=args.n_clust)
-    metric_func = metrics[args.metric]
-
-    for file in args.files:
-        img_sizes = get_image_sizes(file, samples=args.samples)
-        samples = len(img_sizes["sizes"])
-        res, prob = metric_func(img_sizes["sizes"])
+def main() -> int:
+    args = cli(METRICS)
 
-        if args.json:
-            print(
-                json.dumps(
-                    {
-                        "file": str(file),
-                        "metric": args.metric,
-                        "resolution": f"{res[0]}x{res[1]}",
-                        "n": samples,
-                        "prob": f"{prob:.2%}",
-                    },
-                    indent=4,
+    if args.benchmark:
+        # One file at a time, so the timings don't compete for cores.
+        failed = 0
+        for file in args.files:
+            result = benchmark_file(file)
+            failed += result["error"] is not None
+            if args.json:
+                print(json.dumps(result), flush=True)
+            elif result["error"] is not None:
+                print(f"File: {result['file']}")
+                print(f"Error: {result['error']}", flush=True)
+            else:
+                print(f"File: {result['file']}")
+                print(
+                    f"pages:{result['pages']}, native:{result['native_ms']:.2f}ms, "
+                    f"pil:{result['pil_ms']:.2f}ms, speedup:{result['speedup']}x, "
+                    f"mismatches:{result['mismatches']}",
+                    flush=True,
                 )
-            )
-        else:
-            info = [
-                f"Metric:{args.metric}",
-                f"Resolution:{res[0]}x{res[1]}",
-                f"n:{samples}, p:{prob:.2%}",
-            ]
-            print(f"File: {file}")
-            print(*info, sep=", ", end="\n")
+        return 1 if failed else 0
+
+    # Results are printed in the order the files finish, not the order they were given.
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(scan_file, file, args.samples, args.metric, args.n_clust)
+            for file in args.files
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            record = future.result()
+            failed += record["error"] is not None
+            if args.json:
+                print(json.dumps(record), flush=True)
+            elif record["error"] is not None:
+                print(f"File: {record['file']}")
+                print(f"Error: {record['error']}", flush=True)
+            else:
+                info = [
+                    f"Metric:{record['metric']}",
+                    f"Resolution:{record['resolution']}",
+                    f"n:{record['n']}, p:{record['prob']}",
+                    f"decompressed:{format_bytes(record['decompressed'])}",
+                ]
+                print(f"File: {record['file']}")
+                print(*info, sep=", ", end="\n", flush=True)
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -3,35 +3,64 @@
 # requires-python = ">=3.13"
 # dependencies = [
 #     "rarfile",
-#     "py7zr",
+#     "py7zr>=1.0",
 #     "typer",
 #     "typing_extensions",
 #     "pillow",
+#     "numpy",
 #     "torch",
 #     "torchvision",
-#     "pandas",
 #     "plotext",
 # ]
 # ///
+import contextlib
+import copy
+import functools
 import glob
+import hashlib
+import io
+import itertools
+import json
 import math
+import multiprocessing
 import os
 import pathlib
+import queue
 import re
+import resource
 import shutil
+import struct
 import subprocess
+import sys
 import tarfile
 import tempfile
+import threading
+import time
 import zipfile
 from abc import ABC, abstractmethod
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
-from multiprocessing import Manager, Queue
-from typing import Callable, Dict, Iterable, Tuple, Type, TypeVar
+from dataclasses import dataclass, field, replace
+from multiprocessing import Manager
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
 import py7zr
 import rarfile
 import typer
-from PIL import Image
+from PIL import Image, ImageFile
+from py7zr.io import BytesIOFactory, Py7zIO, WriterFactory
 from rich.console import Console
 from rich.progress import (
     BarColumn,
@@ -45,6 +74,17 @@ from rich.progress import (
 )
 from typing_extensions import Annotated, Self
 
+# Optional Pillow plugins: AVIF for Pillow builds older than 11.2, and JPEG XL. Importing
+# them registers their formats for reading pages and for the avif/jxl encoder presets.
+with contextlib.suppress(ImportError):
+    import pillow_avif  # noqa: F401
+with contextlib.suppress(ImportError):
+    import pillow_jxl  # noqa: F401
+
+if TYPE_CHECKING:
+    import numpy as np
+    import torch
+
 IMG_EXTENSIONS: set[str] = {
     ".jpeg",
     ".jpg",
@@ -61,8 +101,21 @@ IMG_EXTENSIONS: set[str] = {
     ".pgm",
 }
 
+# Bytes read per step (and at most in total) when probing image headers.
+HEADER_CHUNK_SIZE = 2048
+MAX_HEADER_SIZE = 64 * 1024
+
+# Leading bytes of the compressed streams tarfile can open (gzip, bzip2, xz).
+COMPRESSED_TAR_MAGIC = (b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")
+
+# Default cap on decompressed 7z members waiting to be consumed.
+CB7_MEMORY_BUDGET = 64 * 1024 * 1024
+
 T = TypeVar("T", bound=Type["ArchiveBase"])
 
+# Adds a single member (name, file object) to an archive being written.
+MemberWriter = Callable[[str, IO[bytes]], None]
+
 ARCHIVERS: Dict[str, Type["ArchiveBase"]] = {}
 
 
@@ -77,19 +130,6 @@ def register_archiver(*filetypes: str) -> Callable[[T], T]:
     return register
 
 
-def create_chapter_zip(chapter_data: Tuple[int, str, str, str]) -> str:
-    """Create a single chapter ZIP file"""
-    idx, chapter_files, current_output_dir, input_dir_for_zip = chapter_data
-    out_file = os.path.join(current_output_dir, f"Chapter {idx:03d}.cbz")
-
-    with zipfile.ZipFile(out_file, "w", compression=zipfile.ZIP_STORED) as zf:
-        for fname in chapter_files:
-            full_path = os.path.join(input_dir_for_zip, fname)
-            zf.write(full_path, arcname=fname)
-
-    return out_file
-
-
 def alphanum_key(s: str) -> list[str | int]:
     """
     Split a string into a list of strings and integers for natural sorting.
@@ -123,11 +163,128 @@ def _split_image_iterative(img: Image.Image, size_threshold: int) -> list[Image.
 
 def split_images(
     images: Iterable[Image.Image], size_threshold: int = 5_000_000
-) -> list[Image.Image]:
-    return sum([_split_image_iterative(i, size_threshold) for i in images], [])
+) -> Iterator[Image.Image]:
+    return itertools.chain.from_iterable(
+        _split_image_iterative(i, size_threshold) for i in images
+    )
+
+
+# Rows are scanned at this width at most; gutters span the page, so detail isn't needed.
+GUTTER_SCAN_WIDTH = 256
+
+
+def _row_cut_costs(img: Image.Image) -> "np.ndarray":
+    """
+    Cost of cutting above each row (and below the last one): the pixel variance of the
+    two rows either side of the cut. Blank gutters between panels cost (close to) nothing.
+    """
+    import numpy as np
+
+    width, height = img.size
+    gray = img.convert("L")
+    if width > GUTTER_SCAN_WIDTH:
+        # Averaging columns keeps every row, so cut positions map 1:1 onto the page.
+        gray = gray.resize((GUTTER_SCAN_WIDTH, height), Image.Resampling.BOX)
+    row_variance = np.asarray(gray, dtype=np.float64).var(axis=1)
+    costs = np.zeros(height + 1)
+    costs[1:-1] = row_variance[:-1] + row_variance[1:]
+    return costs
+
+
+def _trailing_min(values: "np.ndarray", window: int) -> "np.ndarray":
+    """out[i] = min(values[i - window + 1 : i + 1]), in O(len(values)) (van Herk/Gil-Werman)."""
+    import numpy as np
+
+    padded = np.concatenate([np.full(window - 1, np.inf), values])
+    blocks = math.ceil(len(padded) / window)
+    padded = np.concatenate([padded, np.full(blocks * window - len(padded), np.inf)])
+    padded = padded.reshape(blocks, window)
+    prefix = np.minimum.accumulate(padded, axis=1).ravel()
+    suffix = np.minimum.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.minimum(
+        suffix[: len(values)], prefix[window - 1 : window - 1 + len(values)]
+    )
+
+
+def _plan_gutter_cuts(
+    costs: "np.ndarray", max_tile_height: int, tiles: int
+) -> list[int]:
+    """
+    Choose the rows at which to cut a page of len(costs) - 1 rows into exactly `tiles`
+    tiles no taller than max_tile_height, minimizing the total cost of the cuts.
+    """
+    import numpy as np
+
+    # best[k][r]: cheapest way to cover rows [0, r) with k tiles and a cut above row r.
+    best = [np.full(len(costs), np.inf)]
+    best[0][0] = 0.0
+    for _ in range(tiles):
+        reachable = np.full(len(costs), np.inf)
+        reachable[1:] = _trailing_min(best[-1], max_tile_height)[:-1]
+        best.append(reachable + costs)
+
+    cuts = [len(costs) - 1]
+    for layer in reversed(best[1:-1]):
+        end = cuts[-1]
+        start = max(0, end - max_tile_height)
+        cuts.append(start + int(layer[start:end].argmin()))
+    return cuts[::-1]
+
+
+def _split_image_at_gutters(
+    img: Image.Image, size_threshold: int
+) -> Iterator[Image.Image]:
+    """
+    Split an image horizontally into the fewest tiles below size_threshold, cutting along
+    the flattest rows available (usually the gutters between panels) instead of through
+    the middle of a panel. Tiles are yielded top to bottom.
+    """
+    width, height = img.size
+    if width * height < size_threshold:
+        yield img
+        return
+
+    max_tile_height = max(1, (size_threshold - 1) // width)
+    tiles = math.ceil(height / max_tile_height)
+    top = 0
+    for cut in _plan_gutter_cuts(_row_cut_costs(img), max_tile_height, tiles):
+        yield img.crop((0, top, width, cut))
+        top = cut
+
+
+def split_images_at_gutters(
+    images: Iterable[Image.Image], size_threshold: int = 5_000_000
+) -> Iterator[Image.Image]:
+    return itertools.chain.from_iterable(
+        _split_image_at_gutters(i, size_threshold) for i in images
+    )
+
+
+def _resample(
+    img: Image.Image, size: Tuple[int, int], reducing_gap: float | None = None
+) -> Image.Image:
+    """
+    LANCZOS-resize img to size. With a reducing_gap, large reductions are done cheaply first:
+    JPEG pages are decoded at reduced scale (draft mode) and the rest is reduced by integer
+    factors, keeping at least reducing_gap times the target size for the final resample.
+    Smaller gaps are faster; None is the exact path.
+    """
+    box = None
+    if reducing_gap is not None:
+        # draft() only has an effect on images that haven't been loaded yet.
+        drafted = img.draft(
+            None, (int(size[0] * reducing_gap), int(size[1] * reducing_gap))
+        )
+        if drafted is not None:
+            box = drafted[1]
+    return img.resize(
+        size, Image.Resampling.LANCZOS, box=box, reducing_gap=reducing_gap
+    )
 
 
-def resize_image(img: Image.Image, size_threshold: int) -> Image.Image:
+def resize_image(
+    img: Image.Image, size_threshold: int, reducing_gap: float | None = None
+) -> Image.Image:
     """
     Resize an image proportionally so that its total number of pixels is below or equal to size_threshold.
     If the image is already within the threshold, it is returned unchanged.
@@ -138,16 +295,20 @@ def resize_image(img: Image.Image, size_threshold: int) -> Image.Image:
     scale_factor = math.sqrt(size_threshold / (width * height))
     new_width = max(1, int(width * scale_factor))
     new_height = max(1, int(height * scale_factor))
-    return img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    return _resample(img, (new_width, new_height), reducing_gap)
 
 
 def resize_images(
-    images: Iterable[Image.Image], size_threshold: int = 5_000_000
+    images: Iterable[Image.Image],
+    size_threshold: int = 5_000_000,
+    reducing_gap: float | None = None,
 ) -> list[Image.Image]:
-    return [resize_image(image, size_threshold) for image in images]
+    return [resize_image(image, size_threshold, reducing_gap) for image in images]
 
 
-def resize_image_by_width(img: Image.Image, max_width: int) -> Image.Image:
+def resize_image_by_width(
+    img: Image.Image, max_width: int, reducing_gap: float | None = None
+) -> Image.Image:
     """
     Resize an image proportionally to a maximum width.
     If the image width is already within the max_width, it is returned unchanged.
@@ -157,13 +318,197 @@ def resize_image_by_width(img: Image.Image, max_width: int) -> Image.Image:
         return img
     scale_factor = max_width / width
     new_height = max(1, int(height * scale_factor))
-    return img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+    return _resample(img, (max_width, new_height), reducing_gap)
 
 
 def resize_images_by_width(
-    images: Iterable[Image.Image], max_width: int
+    images: Iterable[Image.Image], max_width: int, reducing_gap: float | None = None
 ) -> list[Image.Image]:
-    return [resize_image_by_width(image, max_width) for image in images]
+    return [resize_image_by_width(image, max_width, reducing_gap) for image in images]
+
+
+@dataclass(frozen=True)
+class Encoder:
+    """An output image format for clamp, with fixed Pillow save options."""
+
+    name: str
+    format: str
+    extension: str
+    options: Mapping[str, object] = field(default_factory=dict)
+    alpha: bool = False
+    grayscale: bool = False
+    description: str = ""
+
+    def with_overrides(
+        self: Self, quality: int | None = None, method: int | None = None
+    ) -> "Encoder":
+        """Return a copy with quality and/or WebP method replaced, where the format has them."""
+        options = dict(self.options)
+        if quality is not None and "quality" in options:
+            options["quality"] = quality
+        if method is not None and "method" in options:
+            options["method"] = method
+        return replace(self, options=options)
+
+    def prepare(self: Self, image: Image.Image) -> Image.Image:
+        """
+        Convert an image to the closest mode this format can store, keeping grayscale pages
+        single-channel and alpha only where the format supports them.
+        """
+        if image.mode == "P":
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        if image.mode in ("1", "L", "I", "I;16", "F"):
+            return image.convert("L" if self.grayscale else "RGB")
+        if image.mode in ("LA", "La"):
+            if self.alpha:
+                return image.convert("LA" if self.grayscale else "RGBA")
+            return image.convert("L" if self.grayscale else "RGB")
+        if image.mode in ("RGBA", "RGBa", "PA"):
+            if self.alpha:
+                return image.convert("RGBA")
+            # Flatten onto white rather than letting transparent areas turn black.
+            background = Image.new("RGBA", image.size, "white")
+            return Image.alpha_composite(background, image.convert("RGBA")).convert(
+                "RGB"
+            )
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+    def save(
+        self: Self, image: Image.Image, fp: str | pathlib.Path | IO[bytes]
+    ) -> None:
+        self.prepare(image).save(fp, format=self.format, **self.options)
+
+
+ENCODERS: Dict[str, Encoder] = {}
+
+
+def register_encoder(encoder: Encoder) -> Encoder:
+    """Register an encoder preset, provided this Pillow build can write its format."""
+    Image.init()
+    if encoder.format in Image.SAVE:
+        ENCODERS[encoder.name] = encoder
+    return encoder
+
+
+register_encoder(
+    Encoder(
+        "webp",
+        "WEBP",
+        ".webp",
+        {"quality": 90, "method": 4},
+        alpha=True,
+        description="Lossy WebP at Pillow's default effort.",
+    )
+)
+register_encoder(
+    Encoder(
+        "webp-fast",
+        "WEBP",
+        ".webp",
+        {"quality": 90, "method": 0},
+        alpha=True,
+        description="Lossy WebP, fastest method; larger files.",
+    )
+)
+register_encoder(
+    Encoder(
+        "webp-small",
+        "WEBP",
+        ".webp",
+        {"quality": 85, "method": 6},
+        alpha=True,
+        description="Lossy WebP, slowest method; smallest files.",
+    )
+)
+register_encoder(
+    Encoder(
+        "webp-lossless",
+        "WEBP",
+        ".webp",
+        {"lossless": True, "quality": 80, "method": 4},
+        alpha=True,
+        description="Lossless WebP; quality sets compression effort.",
+    )
+)
+register_encoder(
+    Encoder(
+        "jpeg",
+        "JPEG",
+        ".jpg",
+        {"quality": 90, "optimize": True, "progressive": True},
+        grayscale=True,
+        description="Optimized progressive JPEG.",
+    )
+)
+register_encoder(
+    Encoder(
+        "png",
+        "PNG",
+        ".png",
+        {"compress_level": 6},
+        alpha=True,
+        grayscale=True,
+        description="Lossless PNG.",
+    )
+)
+register_encoder(
+    Encoder(
+        "avif",
+        "AVIF",
+        ".avif",
+        {"quality": 75, "speed": 6},
+        alpha=True,
+        description="Lossy AVIF (needs Pillow 11.2+ or the pillow-avif-plugin package).",
+    )
+)
+register_encoder(
+    Encoder(
+        "jxl",
+        "JXL",
+        ".jxl",
+        {"quality": 90, "effort": 7},
+        alpha=True,
+        grayscale=True,
+        description="JPEG XL (needs the pillow-jxl-plugin package).",
+    )
+)
+
+
+def is_image_name(name: str) -> bool:
+    """Return True if the filename has a supported image extension."""
+    return os.path.splitext(name)[-1].lower() in IMG_EXTENSIONS
+
+
+def natural_sorted(names: Iterable[str]) -> list[str]:
+    """Sort filenames in natural (human) order."""
+    return sorted(names, key=alphanum_key)
+
+
+class PageInfo(NamedTuple):
+    name: str
+    width: int
+    height: int
+    format: str | None
+
+
+def probe_image_header(fp: IO[bytes], name: str = "") -> PageInfo:
+    """
+    Read just enough of an image stream for PIL to parse its header and return its dimensions.
+    Falls back to a full read if the header doesn't fit into MAX_HEADER_SIZE bytes.
+    """
+    parser = ImageFile.Parser()
+    header = b""
+    while len(header) < MAX_HEADER_SIZE:
+        chunk = fp.read(HEADER_CHUNK_SIZE)
+        if not chunk:
+            break
+        header += chunk
+        parser.feed(chunk)
+        if parser.image:
+            width, height = parser.image.size
+            return PageInfo(name, width, height, parser.image.format)
+    with Image.open(io.BytesIO(header + fp.read())) as img:
+        return PageInfo(name, img.width, img.height, img.format)
 
 
 # Base class for archives.
@@ -183,10 +528,61 @@ class ArchiveBase(ABC):
     def compress(source_dir: pathlib.Path, dest: pathlib.Path) -> None:
         raise NotImplementedError
 
+    @staticmethod
+    @abstractmethod
+    def open_writer(dest: pathlib.Path) -> ContextManager[MemberWriter]:
+        """
+        Open a new archive at dest and yield a callable that adds one member
+        from a file object, so archives can be built without a staging directory.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def member_names(self: Self) -> list[str]:
+        """Return the names of all regular file members in natural sort order."""
+        raise NotImplementedError
+
+    def page_names(self: Self) -> list[str]:
+        """Return the names of all image members in natural sort order."""
+        return [name for name in self.member_names() if is_image_name(name)]
+
     @abstractmethod
+    def iter_members(
+        self: Self, names: Iterable[str] | None = None
+    ) -> Iterator[Tuple[str, IO[bytes]]]:
+        """
+        Yield (name, file object) for each image member, in the order of `names`
+        (defaults to `page_names()`). Each file object is closed once the caller advances.
+        """
+        raise NotImplementedError
+
+    def is_solid(self: Self) -> bool:
+        """
+        True when reaching a member means decompressing the ones before it, so the
+        archive should be read in a single pass rather than by several readers at once.
+        """
+        return False
+
+    def iter_pages(
+        self: Self, names: Iterable[str] | None = None
+    ) -> Iterator[Tuple[str, Image.Image]]:
+        """
+        Lazily yield (name, image) for each page in natural sort order.
+        Each image is closed once the caller advances; call `.copy()` to keep it around.
+        """
+        for name, fp in self.iter_members(names):
+            with Image.open(fp) as img:
+                yield name, img
+
+    def probe_pages(self: Self, names: Iterable[str] | None = None) -> list[PageInfo]:
+        """
+        Return (name, width, height, format) for each page, reading only the image headers.
+        """
+        return [probe_image_header(fp, name) for name, fp in self.iter_members(names)]
+
     def get_images(self: Self) -> list[Image.Image]:
         """Return a list of PIL Image objects."""
-        raise NotImplementedError
+        return [img.copy() for _, img in self.iter_pages()]
 
 
 @register_archiver(".cbz", ".zip")
@@ -201,17 +597,80 @@ class ArchiveCBZ(ArchiveBase):
         archive = shutil.make_archive(base_name, "zip", root_dir=source_dir)
         os.replace(archive, dest)
 
-    def get_images(self: Self) -> list[Image.Image]:
+    @staticmethod
+    @contextlib.contextmanager
+    def open_writer(dest: pathlib.Path) -> Iterator[MemberWriter]:
+        with zipfile.ZipFile(dest, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+
+            def add(name: str, fp: IO[bytes]) -> None:
+                with zf.open(name, "w") as out:
+                    shutil.copyfileobj(fp, out)
+
+            yield add
+
+    def member_names(self: Self) -> list[str]:
         with zipfile.ZipFile(self.path) as zf:
-            images: list[Tuple[str, Image.Image]] = sorted(
-                [
-                    (file, Image.open(zf.open(file)))
-                    for file in zf.namelist()
-                    if os.path.splitext(file)[-1].lower() in IMG_EXTENSIONS
-                ],
-                key=lambda x: alphanum_key(str(x[0])),
+            return natural_sorted(
+                info.filename for info in zf.infolist() if not info.is_dir()
             )
-        return [img for _, img in images]
+
+    def copy_raw(
+        self: Self,
+        dest: pathlib.Path,
+        names: list[str] | None = None,
+        on_member: Callable[[str, int], None] | None = None,
+    ) -> int:
+        """
+        Write members (defaults to all of them) to a new zip at dest by copying their
+        compressed bytes as stored, without inflating or deflating anything.
+        Returns the number of members written; on_member(name, total) is called after each.
+        """
+        names = self.member_names() if names is None else names
+        count = 0
+        with (
+            zipfile.ZipFile(self.path) as src,
+            open(self.path, "rb") as raw,
+            zipfile.ZipFile(dest, "w") as out,
+        ):
+            for name in names:
+                info = src.getinfo(name)
+                raw.seek(info.header_offset)
+                *_, name_length, extra_length = struct.unpack(
+                    zipfile.structFileHeader, raw.read(zipfile.sizeFileHeader)
+                )
+                raw.seek(name_length + extra_length, os.SEEK_CUR)
+
+                # zipfile has no raw-copy API, so write the local header and data ourselves
+                # and register the entry for the central directory written on close.
+                member = copy.copy(info)
+                # Sizes and CRC are known up front, so no trailing data descriptor.
+                member.flag_bits &= ~0x08
+                member.header_offset = out.fp.tell()
+                out.fp.write(member.FileHeader())
+                remaining = info.compress_size
+                while remaining:
+                    chunk = raw.read(min(remaining, 1 << 20))
+                    if not chunk:
+                        raise zipfile.BadZipFile(f"Truncated member {name}")
+                    out.fp.write(chunk)
+                    remaining -= len(chunk)
+                out.filelist.append(member)
+                out.NameToInfo[member.filename] = member
+                out.start_dir = out.fp.tell()
+
+                count += 1
+                if on_member is not None:
+                    on_member(name, len(names))
+        return count
+
+    def iter_members(
+        self: Self, names: Iterable[str] | None = None
+    ) -> Iterator[Tuple[str, IO[bytes]]]:
+        names = self.page_names() if names is None else names
+        with zipfile.ZipFile(self.path) as zf:
+            for name in names:
+                with zf.open(name) as fp:
+                    yield name, fp
 
 
 @register_archiver(".rar", ".cbr")
@@ -221,7 +680,7 @@ class ArchiveCBR(ArchiveBase):
             rf.extractall(path=str(dest))
 
     @staticmethod
-    def compress(source_dir: pathlib.Path, dest: pathlib.Path) -> None:
+    def _require_rar() -> None:
         try:
             subprocess.run(["rar"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         except FileNotFoundError as err:
@@ -229,26 +688,197 @@ class ArchiveCBR(ArchiveBase):
                 "RAR command-line tool is not installed or not in PATH; cannot create CBR files."
             ) from err
 
+    @staticmethod
+    def compress(source_dir: pathlib.Path, dest: pathlib.Path) -> None:
+        ArchiveCBR._require_rar()
         cmd: list[str] = ["rar", "a", "-idq", "-ep1", str(dest)] + glob.glob(
             str(source_dir / "*")
         )
         subprocess.run(cmd, cwd=source_dir, check=True)
 
-    def get_images(self: Self) -> list[Image.Image]:
+    @staticmethod
+    @contextlib.contextmanager
+    def open_writer(dest: pathlib.Path) -> Iterator[MemberWriter]:
+        ArchiveCBR._require_rar()
+        # rar can't append from a Python stream, so members are staged next to dest and
+        # archived by a single rar run, from a list file to keep their order, once the
+        # writer closes.
+        with tempfile.TemporaryDirectory(
+            prefix=".rar-staging-", dir=dest.parent
+        ) as staging:
+            members_dir = pathlib.Path(staging) / "members"
+            names: list[str] = []
+
+            def add(name: str, fp: IO[bytes]) -> None:
+                target = members_dir / name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                with open(target, "wb") as out:
+                    shutil.copyfileobj(fp, out)
+                names.append(name)
+
+            yield add
+            if names:
+                list_file = pathlib.Path(staging) / "members.lst"
+                list_file.write_text("\n".join(names) + "\n", encoding="utf-8")
+                subprocess.run(
+                    ["rar", "a", "-idq", "-scfl", str(dest.resolve()), f"@{list_file}"],
+                    cwd=members_dir,
+                    check=True,
+                )
+
+    def member_names(self: Self) -> list[str]:
         with rarfile.RarFile(self.path) as rf:
-            images: list[Tuple[str, Image.Image]] = sorted(
-                [
-                    (file, Image.open(rf.open(file)))
-                    for file in rf.namelist()
-                    if os.path.splitext(file)[-1].lower() in IMG_EXTENSIONS
-                ],
-                key=lambda x: alphanum_key(str(x[0])),
+            return natural_sorted(
+                info.filename for info in rf.infolist() if not info.is_dir()
+            )
+
+    def is_solid(self: Self) -> bool:
+        with rarfile.RarFile(self.path) as rf:
+            return rf.is_solid()
+
+    def iter_members(
+        self: Self, names: Iterable[str] | None = None
+    ) -> Iterator[Tuple[str, IO[bytes]]]:
+        names = self.page_names() if names is None else names
+        with rarfile.RarFile(self.path) as rf:
+            for name in names:
+                with rf.open(name) as fp:
+                    yield name, fp
+
+
+class _SevenZipCancelled(Exception):
+    """Raised inside py7zr's extraction when the consumer stops early."""
+
+
+class _SevenZipMember(Py7zIO):
+    """Collects one decompressed 7z member and hands it to the stream once complete."""
+
+    def __init__(self: Self, stream: "_SevenZipStream", name: str) -> None:
+        self.stream = stream
+        self.name = name
+        self.buffer = bytearray()
+        self.published = False
+
+    def write(self: Self, s: bytes | bytearray) -> int:
+        if self.stream.cancelled:
+            raise _SevenZipCancelled
+        self.buffer += s
+        return len(s)
+
+    def read(self: Self, size: int | None = None) -> bytes:
+        return b""
+
+    def seek(self: Self, offset: int, whence: int = 0) -> int:
+        return 0
+
+    def flush(self: Self) -> None:
+        pass
+
+    def size(self: Self) -> int:
+        return len(self.buffer)
+
+    def close(self: Self) -> None:
+        if not self.published:
+            self.published = True
+            self.stream.publish(self.name, bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+class _SevenZipStream(WriterFactory):
+    """
+    Turns py7zr's push-style extraction into a pull-style iterator.
+
+    py7zr decompresses on a background thread in archive order. Finished members wait in
+    `ready` until the consumer asks for them, and the producer blocks while more than
+    `budget` bytes are waiting, unless the consumer is blocked on a page that hasn't
+    arrived yet. A name may be asked for more than once; it is kept until its last use.
+    """
+
+    def __init__(self: Self, path: pathlib.Path, names: list[str], budget: int) -> None:
+        self.path = path
+        self.names = names
+        self.budget = budget
+        self.cond = threading.Condition()
+        self.ready: dict[str, bytes] = {}
+        self.uses: dict[str, int] = {}
+        for name in names:
+            self.uses[name] = self.uses.get(name, 0) + 1
+        self.used = 0
+        # The page the consumer is blocked on, or None while it works on the last one.
+        self.waiting: str | None = None
+        self.finished = False
+        self.cancelled = False
+        self.error: BaseException | None = None
+
+    def create(self: Self, filename: str) -> Py7zIO:
+        return _SevenZipMember(self, filename)
+
+    def publish(self: Self, name: str, data: bytes) -> None:
+        with self.cond:
+            self.ready[name] = data
+            self.used += len(data)
+            self.cond.notify_all()
+            self.cond.wait_for(
+                lambda: (
+                    self.cancelled
+                    or self.used <= self.budget
+                    or (self.waiting is not None and self.waiting not in self.ready)
+                )
             )
-        return [img for _, img in images]
+
+    def _produce(self: Self) -> None:
+        try:
+            with py7zr.SevenZipFile(self.path, mode="r") as sz:
+                sz.extract(targets=self.names, factory=self)
+        except _SevenZipCancelled:
+            pass
+        except BaseException as err:
+            self.error = err
+        finally:
+            with self.cond:
+                self.finished = True
+                self.cond.notify_all()
+
+    def __iter__(self: Self) -> Iterator[Tuple[str, IO[bytes]]]:
+        producer = threading.Thread(target=self._produce, daemon=True)
+        producer.start()
+        try:
+            for name in self.names:
+                with self.cond:
+                    self.waiting = name
+                    self.cond.notify_all()
+                    self.cond.wait_for(
+                        lambda: self.waiting in self.ready or self.finished
+                    )
+                    self.waiting = None
+                    if name not in self.ready:
+                        if self.error is not None:
+                            raise self.error
+                        raise KeyError(f"{name} not found in {self.path}")
+                    self.uses[name] -= 1
+                    if self.uses[name]:
+                        data = self.ready[name]
+                    else:
+                        data = self.ready.pop(name)
+                        self.used -= len(data)
+                        self.cond.notify_all()
+                with io.BytesIO(data) as fp:
+                    yield name, fp
+        finally:
+            with self.cond:
+                self.cancelled = True
+                self.cond.notify_all()
+            producer.join()
 
 
 @register_archiver(".7z", ".cb7")
 class ArchiveCB7(ArchiveBase):
+    def __init__(
+        self: Self, path: str | pathlib.Path, memory_budget: int = CB7_MEMORY_BUDGET
+    ) -> None:
+        super().__init__(path)
+        self.memory_budget = memory_budget
+
     def extract(self: Self, dest: pathlib.Path) -> None:
         with py7zr.SevenZipFile(self.path, mode="r") as sz:
             sz.extractall(path=str(dest))
@@ -258,18 +888,36 @@ class ArchiveCB7(ArchiveBase):
         with py7zr.SevenZipFile(dest, mode="w") as sz:
             sz.writeall(str(source_dir), arcname=".")
 
-    def get_images(self: Self) -> list[Image.Image]:
+    @staticmethod
+    @contextlib.contextmanager
+    def open_writer(dest: pathlib.Path) -> Iterator[MemberWriter]:
+        with py7zr.SevenZipFile(dest, mode="w") as sz:
+
+            def add(name: str, fp: IO[bytes]) -> None:
+                sz.writestr(fp.read(), name)
+
+            yield add
+
+    def member_names(self: Self) -> list[str]:
         with py7zr.SevenZipFile(self.path, mode="r") as sz:
-            all_files = sz.readall()
-            images: list[Tuple[str, Image.Image]] = sorted(
-                [
-                    (fname, Image.open(file_obj))
-                    for fname, file_obj in all_files.items()
-                    if os.path.splitext(fname)[-1].lower() in IMG_EXTENSIONS
-                ],
-                key=lambda x: alphanum_key(x[0]),
+            return natural_sorted(
+                info.filename for info in sz.list() if not info.is_directory
             )
-        return [img for _, img in images]
+
+    def is_solid(self: Self) -> bool:
+        with py7zr.SevenZipFile(self.path, mode="r") as sz:
+            return sz.archiveinfo().solid
+
+    def iter_members(
+        self: Self, names: Iterable[str] | None = None
+    ) -> Iterator[Tuple[str, IO[bytes]]]:
+        """
+        Stream members in a single decompression pass, holding at most about
+        `memory_budget` bytes of decompressed pages that haven't been consumed yet.
+        """
+        names = self.page_names() if names is None else list(names)
+        if names:
+            yield from _SevenZipStream(self.path, names, self.memory_budget)
 
 
 @register_archiver(".tar", ".cbt")
@@ -287,19 +935,42 @@ class ArchiveCBT(ArchiveBase):
                     full_path = root_path / file
                     tf.add(full_path, arcname=full_path.relative_to(source_dir))
 
-    def get_images(self: Self) -> list[Image.Image]:
+    @staticmethod
+    @contextlib.contextmanager
+    def open_writer(dest: pathlib.Path) -> Iterator[MemberWriter]:
+        with tarfile.open(dest, "w") as tf:
+
+            def add(name: str, fp: IO[bytes]) -> None:
+                data = fp.read()
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tf.addfile(info, io.BytesIO(data))
+
+            yield add
+
+    def member_names(self: Self) -> list[str]:
         with tarfile.open(self.path, "r:*") as tf:
-            members = tf.getmembers()
-            images = sorted(
-                [
-                    (member.name, Image.open(tf.extractfile(member)).copy())
-                    for member in members
-                    if member.isfile()
-                    and os.path.splitext(member.name)[-1].lower() in IMG_EXTENSIONS
-                ],
-                key=lambda x: alphanum_key(x[0]),
+            return natural_sorted(
+                member.name for member in tf.getmembers() if member.isfile()
             )
-        return [img for _, img in images]
+
+    def is_solid(self: Self) -> bool:
+        # A compressed tar is a single stream, headers included.
+        with open(self.path, "rb") as fp:
+            return fp.read(6).startswith(COMPRESSED_TAR_MAGIC)
+
+    def iter_members(
+        self: Self, names: Iterable[str] | None = None
+    ) -> Iterator[Tuple[str, IO[bytes]]]:
+        names = self.page_names() if names is None else names
+        with tarfile.open(self.path, "r:*") as tf:
+            for name in names:
+                fp = tf.extractfile(name)
+                if fp is None:
+                    raise KeyError(f"{name} is not a regular file in {self.path}")
+                with fp:
+                    yield name, fp
 
 
 @register_archiver("/")
@@ -311,16 +982,41 @@ class ArchiveDir(ArchiveBase):
     def compress(source_dir: pathlib.Path, dest: pathlib.Path) -> None:
         shutil.copytree(source_dir, dest, dirs_exist_ok=True)
 
-    def get_images(self: Self) -> list[Image.Image]:
-        images = sorted(
-            [
-                (file, Image.open(file))
-                for file in self.path.iterdir()
-                if file.suffix.lower() in IMG_EXTENSIONS and file.is_file()
-            ],
-            key=lambda x: alphanum_key(str(x[0])),
+    @staticmethod
+    @contextlib.contextmanager
+    def open_writer(dest: pathlib.Path) -> Iterator[MemberWriter]:
+        dest.mkdir(parents=True, exist_ok=True)
+
+        def add(name: str, fp: IO[bytes]) -> None:
+            target = dest / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with open(target, "wb") as out:
+                shutil.copyfileobj(fp, out)
+
+        yield add
+
+    def member_names(self: Self) -> list[str]:
+        return natural_sorted(
+            file.relative_to(self.path).as_posix()
+            for file in self.path.rglob("*")
+            if file.is_file()
+        )
+
+    def page_names(self: Self) -> list[str]:
+        # Pages only come from the top level of a directory.
+        return natural_sorted(
+            file.name
+            for file in self.path.iterdir()
+            if file.is_file() and is_image_name(file.name)
         )
-        return [img for _, img in images]
+
+    def iter_members(
+        self: Self, names: Iterable[str] | None = None
+    ) -> Iterator[Tuple[str, IO[bytes]]]:
+        names = self.page_names() if names is None else names
+        for name in names:
+            with open(self.path / name, "rb") as fp:
+                yield name, fp
 
 
 def archiver_factory(d: pathlib.Path) -> ArchiveBase | None:
@@ -335,102 +1031,629 @@ def archiver_factory(d: pathlib.Path) -> ArchiveBase | None:
         return None
 
 
-def _process_chapter_item_worker(
-    chapter_path: pathlib.Path,
-    output_dir: pathlib.Path,
-    size_threshold: int,
-    process_func: Callable[[Iterable[Image.Image], int], list[Image.Image]],
-    progress_queue: Queue,
-    approach: str,
+class ProgressChannel:
+    """
+    Coalescing progress channel from pool workers to the main process.
+
+    Unlike a Manager().Queue(), which costs a round trip through the manager process for
+    every message, this sits on a plain multiprocessing.Queue and sends messages in batches.
+    Routine messages are held for up to `interval` seconds (or `max_batch` messages), and
+    any other message flushes the batch immediately.
+    """
+
+    ROUTINE_MESSAGES = frozenset({"page_done", "member_done"})
+
+    def __init__(self: Self, interval: float = 0.1, max_batch: int = 256) -> None:
+        self.queue: multiprocessing.Queue = multiprocessing.Queue()
+        self.interval = interval
+        self.max_batch = max_batch
+        self.pending: list[dict] = []
+        self.last_flush = time.monotonic()
+
+    def __getstate__(self: Self) -> dict:
+        # Each worker starts with its own empty batch.
+        return {**self.__dict__, "pending": []}
+
+    def __enter__(self: Self) -> Self:
+        return self
+
+    def __exit__(self: Self, *exc_info) -> None:
+        self.queue.close()
+        self.queue.join_thread()
+
+    def put(self: Self, message: dict) -> None:
+        self.pending.append(message)
+        if (
+            message["type"] not in self.ROUTINE_MESSAGES
+            or len(self.pending) >= self.max_batch
+            or time.monotonic() - self.last_flush >= self.interval
+        ):
+            self.flush()
+
+    def flush(self: Self) -> None:
+        if self.pending:
+            self.queue.put(self.pending)
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+    def get(self: Self) -> list[dict]:
+        """Block until the next batch of messages arrives."""
+        return self.queue.get()
+
+
+# Per-process state for pool workers, installed by _init_pool_worker.
+_worker_progress: ProgressChannel | None = None
+_worker_io_slot: ContextManager | None = None
+
+
+def _init_pool_worker(
+    progress: ProgressChannel, io_slot: ContextManager | None = None
 ) -> None:
     """
-    Worker function to process a single chapter/file in a separate process.
-    Sends progress updates and errors back to the main process via a queue.
+    ProcessPoolExecutor initializer. Queues and semaphores can only reach workers through
+    inheritance, not as arguments to submit().
     """
-    try:
-        archiver = archiver_factory(chapter_path)
-        if not archiver:
-            progress_queue.put(
-                {
-                    "type": "error",
-                    "chapter_name": chapter_path.name,
-                    "message": f"Unsupported file type for {chapter_path.name}",
-                }
-            )
-            return
+    global _worker_progress, _worker_io_slot
+    _worker_progress = progress
+    _worker_io_slot = io_slot
 
-        original_images = archiver.get_images()
-        output_chapter_dir = output_dir / chapter_path.stem
-        if output_chapter_dir.exists():
-            shutil.rmtree(output_chapter_dir)
 
-        if approach in ("split", "resize"):
-            max_image_dimension = max(
-                (img.size[0] * img.size[1] for img in original_images), default=0
-            )
-        else:  # max-width
-            max_image_dimension = max(
-                (img.size[0] for img in original_images), default=0
-            )
+def _worker_progress_channel() -> ProgressChannel:
+    if _worker_progress is None:
+        raise RuntimeError("pool worker was started without a progress channel")
+    return _worker_progress
 
-        if max_image_dimension < size_threshold:
-            archiver.extract(output_chapter_dir)
-            progress_queue.put(
-                {
-                    "type": "chapter_done",
-                    "chapter_name": chapter_path.name,
-                    "total_images": len(original_images),
-                }
-            )
-        else:
-            converted_images = process_func(original_images, size_threshold)
-            output_chapter_dir.mkdir(exist_ok=True, parents=True)
 
-            for num, image in enumerate(converted_images, 1):
-                output_filepath = output_chapter_dir / f"{num:03}.webp"
-                image.convert("RGB").save(
-                    str(output_filepath), format="webp", quality=90
-                )
-                progress_queue.put(
-                    {
-                        "type": "image_saved",
-                        "chapter_name": chapter_path.name,
-                        "image_filename": f"{num:03}.webp",
-                        "total_images": len(converted_images),
-                    }
-                )
-            progress_queue.put(
-                {
-                    "type": "chapter_done",
-                    "chapter_name": chapter_path.name,
-                    "total_images": len(converted_images),
-                }
-            )
+@contextlib.contextmanager
+def atomic_output(dest: pathlib.Path) -> Iterator[pathlib.Path]:
+    """
+    Yield a temporary path next to dest and move it into place only once the block succeeds,
+    so readers never see a half-written archive.
+    """
+    temp = dest.with_name(f".{dest.stem}.{os.getpid()}.partial{dest.suffix}")
+    try:
+        yield temp
+        if dest.is_dir() and temp.is_dir():
+            shutil.rmtree(dest)
+        os.replace(temp, dest)
+    finally:
+        if temp.is_dir():
+            shutil.rmtree(temp)
+        elif temp.exists():
+            temp.unlink()
+
+
+def transcode_archive(
+    source: ArchiveBase,
+    target: Type[ArchiveBase],
+    dest: pathlib.Path,
+    on_member: Callable[[str, int], None] | None = None,
+    io_slot: ContextManager | None = None,
+) -> int:
+    """
+    Copy every member of source straight into a new target-format archive at dest,
+    without an intermediate directory (or any recompression, for zip to zip).
+    Returns the number of members written.
 
-    except Exception as e:
+    on_member(name, total) is called after each member. io_slot, if given, is held for
+    the whole copy, reading and decompressing the source as well as writing dest, to
+    limit how many jobs hit the disk at once.
+    """
+    io_slot = io_slot if io_slot is not None else contextlib.nullcontext()
+    count = 0
+    with io_slot, atomic_output(dest) as temp:
+        names = source.member_names()
+        if isinstance(source, ArchiveCBZ) and target is ArchiveCBZ:
+            # Same container: members are copied still compressed.
+            return source.copy_raw(temp, names, on_member)
+        with target.open_writer(temp) as add:
+            for name, fp in source.iter_members(names):
+                add(name, fp)
+                count += 1
+                if on_member is not None:
+                    on_member(name, len(names))
+    return count
+
+
+def _convert_file_worker(file_path: pathlib.Path, target_ext: str) -> None:
+    """
+    Worker function to convert a single archive in a separate process.
+    Sends progress updates and errors back to the main process via the pool's progress channel.
+    """
+    progress_queue = _worker_progress_channel()
+
+    def on_member(name: str, total: int) -> None:
         progress_queue.put(
             {
-                "type": "error",
-                "chapter_name": chapter_path.name,
-                "message": str(e),
+                "type": "member_done",
+                "file_name": file_path.name,
+                "member_name": name,
+                "total_members": total,
             }
         )
 
+    try:
+        transcode_archive(
+            ARCHIVERS[file_path.suffix.lower()](file_path),
+            ARCHIVERS[target_ext],
+            file_path.with_name(file_path.stem + target_ext),
+            on_member=on_member,
+            io_slot=_worker_io_slot,
+        )
+        progress_queue.put({"type": "file_done", "file_name": file_path.name})
+    except Exception as e:
+        progress_queue.put(
+            {"type": "error", "file_name": file_path.name, "message": str(e)}
+        )
 
-# ==============================================================
-# CLI GROUP DEFINITION (Both Subcommands)
-# ==============================================================
 
+def source_fingerprint(path: pathlib.Path, content_hash: bool = False) -> dict:
+    """
+    Cheap identity of a chapter source: total size, newest mtime and file count, plus a
+    BLAKE2b digest of the contents when content_hash is set.
+    """
+    if path.is_file():
+        files = {path.name: path}
+    else:
+        files = {
+            file.relative_to(path).as_posix(): file
+            for file in path.rglob("*")
+            if file.is_file()
+        }
+    stats = [file.stat() for file in files.values()]
+    fingerprint: dict = {
+        "size": sum(stat.st_size for stat in stats),
+        "mtime_ns": max((stat.st_mtime_ns for stat in stats), default=0),
+        "files": len(files),
+    }
+    if content_hash:
+        digest = hashlib.blake2b()
+        for name in natural_sorted(files):
+            digest.update(name.encode())
+            with open(files[name], "rb") as fp:
+                while chunk := fp.read(1 << 20):
+                    digest.update(chunk)
+        fingerprint["blake2b"] = digest.hexdigest()
+    return fingerprint
+
+
+class ClampManifest:
+    """
+    Record of what clamp has already produced in an output directory, so reruns only touch
+    new or changed chapters. Each chapter entry stores the source fingerprint and the
+    clamp parameters it was produced with.
+    """
 
-app = typer.Typer(add_completion=True)
+    FILENAME = ".clamp-manifest.json"
+    VERSION = 1
+    # Seconds between checkpoints while a run is in progress.
+    CHECKPOINT_INTERVAL = 30.0
 
+    def __init__(self: Self, output_dir: pathlib.Path) -> None:
+        self.path = output_dir / self.FILENAME
+        self.chapters: dict[str, dict] = {}
+        self.last_save = time.monotonic()
+        try:
+            data = json.loads(self.path.read_text())
+            if data.get("version") == self.VERSION:
+                self.chapters = data["chapters"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            # Missing or unreadable manifests just mean everything gets processed.
+            pass
+
+    def is_current(
+        self: Self,
+        chapter_path: pathlib.Path,
+        params: dict,
+        content_hash: bool = False,
+    ) -> bool:
+        entry = self.chapters.get(chapter_path.name)
+        if entry is None or entry.get("params") != params:
+            return False
+        output_path = self.path.parent / entry.get("output", chapter_path.stem)
+        if not output_path.exists():
+            return False
+        recorded = entry.get("source", {})
+        current = source_fingerprint(chapter_path)
+        if (
+            recorded.get("size") != current["size"]
+            or recorded.get("files") != current["files"]
+        ):
+            return False
+        if recorded.get("mtime_ns") == current["mtime_ns"]:
+            return True
+        if content_hash and "blake2b" in recorded:
+            # Only hash when the mtime moved; a matching digest survives touched mtimes.
+            return (
+                recorded["blake2b"]
+                == source_fingerprint(chapter_path, content_hash=True)["blake2b"]
+            )
+        return False
+
+    def record(
+        self: Self,
+        chapter_name: str,
+        fingerprint: dict,
+        params: dict,
+        total_images: int,
+        output_name: str,
+    ) -> None:
+        self.chapters[chapter_name] = {
+            "source": fingerprint,
+            "params": params,
+            "total_images": total_images,
+            "output": output_name,
+        }
 
-# ----- CONVERT SUBCOMMAND -----
-@app.command()
-def convert(
-    directories: Annotated[
-        list[pathlib.Path],
-        typer.Argument(
+    def discard(self: Self, chapter_name: str) -> None:
+        self.chapters.pop(chapter_name, None)
+
+    def save(self: Self) -> None:
+        temp = self.path.with_name(f"{self.path.name}.{os.getpid()}.partial")
+        temp.write_text(
+            json.dumps({"version": self.VERSION, "chapters": self.chapters}, indent=2)
+        )
+        os.replace(temp, self.path)
+        self.last_save = time.monotonic()
+
+    def checkpoint(self: Self) -> None:
+        """Save if the last save is older than CHECKPOINT_INTERVAL."""
+        if time.monotonic() - self.last_save >= self.CHECKPOINT_INTERVAL:
+            self.save()
+
+    def __enter__(self: Self) -> Self:
+        return self
+
+    def __exit__(self: Self, *exc_info) -> None:
+        # Save whatever finished, even if the run is interrupted.
+        self.save()
+
+
+def _chapter_within_threshold(
+    page_infos: Iterable[PageInfo], approach: str, size_threshold: int
+) -> bool:
+    """Return True if every page already satisfies the clamp threshold."""
+    if approach in ("split", "gutter", "resize"):
+        max_image_dimension = max(
+            (info.width * info.height for info in page_infos), default=0
+        )
+    else:  # max-width
+        max_image_dimension = max((info.width for info in page_infos), default=0)
+    return max_image_dimension < size_threshold
+
+
+def _staged_page_name(page_index: int, image_index: int, extension: str) -> str:
+    """
+    Temporary name for the image_index-th output of source page page_index. Names sort in
+    reading order, so outputs can be numbered once every page's output count is known.
+    """
+    return f".{page_index:05}-{image_index:04}{extension}"
+
+
+def _finalize_chapter_pages(output_chapter_dir: pathlib.Path) -> int:
+    """Rename staged outputs to their final sequential names ({num:03}.<ext>)."""
+    staged = sorted(output_chapter_dir.glob(".[0-9]*-[0-9]*.*"))
+    for num, path in enumerate(staged, 1):
+        path.rename(output_chapter_dir / f"{num:03}{path.suffix}")
+    return len(staged)
+
+
+def _pack_chapter_pages(
+    staging_dir: pathlib.Path, target: Type[ArchiveBase], dest: pathlib.Path
+) -> int:
+    """
+    Write staged outputs into a new target-format archive at dest under their final
+    sequential names, then remove the staging directory.
+    """
+    staged = sorted(staging_dir.glob(".[0-9]*-[0-9]*.*"))
+    with atomic_output(dest) as temp, target.open_writer(temp) as add:
+        for num, path in enumerate(staged, 1):
+            with open(path, "rb") as fp:
+                add(f"{num:03}{path.suffix}", fp)
+    shutil.rmtree(staging_dir)
+    return len(staged)
+
+
+def _chapter_staging_dir(
+    output_dir: pathlib.Path, stem: str, archived: bool
+) -> pathlib.Path:
+    """
+    Where page shards write their outputs: the chapter's own output directory, or for
+    archived output, a hidden directory that is packed once every shard is in.
+    """
+    return output_dir / (f".{stem}.staging" if archived else stem)
+
+
+def _remove_chapter_outputs(output_dir: pathlib.Path, stem: str) -> None:
+    """Remove a chapter's previous output, whether a directory or an archive."""
+    for output_chapter_dir in (
+        _chapter_staging_dir(output_dir, stem, archived=False),
+        _chapter_staging_dir(output_dir, stem, archived=True),
+    ):
+        if output_chapter_dir.is_dir():
+            shutil.rmtree(output_chapter_dir)
+    for suffix in ARCHIVERS:
+        if suffix != "/":
+            (output_dir / f"{stem}{suffix}").unlink(missing_ok=True)
+
+
+def _passthrough_output(
+    chapter_path: pathlib.Path, output_dir: pathlib.Path
+) -> Tuple[Type[ArchiveBase], pathlib.Path]:
+    """
+    Container and destination for a chapter that is copied unchanged: directories stay
+    directories and archives become CBZ, which zip sources reach without recompression.
+    """
+    if chapter_path.is_dir():
+        return ArchiveDir, output_dir / chapter_path.stem
+    suffix = ".zip" if chapter_path.suffix.lower() == ".zip" else ".cbz"
+    return ArchiveCBZ, output_dir / f"{chapter_path.stem}{suffix}"
+
+
+def _clamp_pages(
+    archiver: ArchiveBase,
+    page_names: list[str],
+    first_page: int,
+    size_threshold: int,
+    process_func: Callable[[Iterable[Image.Image], int], Iterable[Image.Image]],
+    save_output: Callable[[int, int, Image.Image], None],
+    progress_queue: ProgressChannel,
+    chapter_name: str,
+    total_pages: int,
+) -> None:
+    """
+    Process page_names (which start at page index first_page within the chapter), passing
+    each output to save_output(page_index, image_index, image) in reading order.
+    """
+    # Stream page by page so only the current page and its outputs are in memory.
+    pages = archiver.iter_pages(page_names)
+    for page_index, (page_name, page) in enumerate(pages, first_page):
+        for image_index, image in enumerate(process_func([page], size_threshold)):
+            save_output(page_index, image_index, image)
+        progress_queue.put(
+            {
+                "type": "page_done",
+                "chapter_name": chapter_name,
+                "page_name": page_name,
+                "total_pages": total_pages,
+            }
+        )
+
+
+def _staged_output_saver(
+    output_chapter_dir: pathlib.Path, encoder: Encoder
+) -> Callable[[int, int, Image.Image], None]:
+    """save_output for _clamp_pages that writes each output as a staged file."""
+
+    def save_output(page_index: int, image_index: int, image: Image.Image) -> None:
+        encoder.save(
+            image,
+            output_chapter_dir
+            / _staged_page_name(page_index, image_index, encoder.extension),
+        )
+
+    return save_output
+
+
+def _process_chapter_item_worker(
+    chapter_path: pathlib.Path,
+    output_dir: pathlib.Path,
+    size_threshold: int,
+    process_func: Callable[[Iterable[Image.Image], int], Iterable[Image.Image]],
+    approach: str,
+    encoder: Encoder,
+    output_ext: str | None = None,
+    num_shards: int = 1,
+    content_hash: bool = False,
+) -> None:
+    """
+    Worker function to process a single chapter/file in a separate process.
+    Sends progress updates and errors back to the main process via the pool's progress channel.
+    With an output_ext, the chapter is written as a single archive of that type instead of
+    a directory. With num_shards > 1, a chapter that needs processing is split into page
+    shards: the main process is sent the others to submit, and this worker processes the
+    first. Solid archives are never split, since every shard would have to decompress
+    the archive from the start to reach its pages. With content_hash, the source's digest is sent along with the chapter's first
+    message for the manifest.
+    """
+    progress_queue = _worker_progress_channel()
+    try:
+        # Hashed here rather than in the main process, so digests overlap with processing.
+        digest = (
+            {"blake2b": source_fingerprint(chapter_path, content_hash=True)["blake2b"]}
+            if content_hash
+            else {}
+        )
+        archiver = archiver_factory(chapter_path)
+        if not archiver:
+            progress_queue.put(
+                {
+                    "type": "error",
+                    "chapter_name": chapter_path.name,
+                    "message": f"Unsupported file type for {chapter_path.name}",
+                }
+            )
+            return
+
+        page_names = archiver.page_names()
+        output_chapter_dir = output_dir / chapter_path.stem
+        _remove_chapter_outputs(output_dir, chapter_path.stem)
+
+        # Only image headers are read, so compliant chapters never touch pixel data.
+        page_infos = archiver.probe_pages(page_names)
+        if _chapter_within_threshold(page_infos, approach, size_threshold):
+            if output_ext is None:
+                target, dest = _passthrough_output(chapter_path, output_dir)
+            else:
+                target = ARCHIVERS[output_ext]
+                dest = output_dir / f"{chapter_path.stem}{output_ext}"
+            transcode_archive(archiver, target, dest)
+            output_name = dest.name
+            total_images = len(page_names)
+        elif num_shards > 1 and len(page_names) > 1 and not archiver.is_solid():
+            output_chapter_dir = _chapter_staging_dir(
+                output_dir, chapter_path.stem, archived=output_ext is not None
+            )
+            output_chapter_dir.mkdir(parents=True)
+            (names, first_page), *shards = _split_page_shards(page_names, num_shards)
+            progress_queue.put(
+                {
+                    "type": "shards",
+                    "chapter_name": chapter_path.name,
+                    "shards": shards,
+                    "total_pages": len(page_names),
+                    **digest,
+                }
+            )
+            _clamp_pages(
+                archiver,
+                names,
+                first_page,
+                size_threshold,
+                process_func,
+                _staged_output_saver(output_chapter_dir, encoder),
+                progress_queue,
+                chapter_path.name,
+                len(page_names),
+            )
+            progress_queue.put(
+                {"type": "shard_done", "chapter_name": chapter_path.name}
+            )
+            return
+        elif output_ext is None:
+            output_chapter_dir.mkdir(exist_ok=True, parents=True)
+            _clamp_pages(
+                archiver,
+                page_names,
+                0,
+                size_threshold,
+                process_func,
+                _staged_output_saver(output_chapter_dir, encoder),
+                progress_queue,
+                chapter_path.name,
+                len(page_names),
+            )
+            total_images = _finalize_chapter_pages(output_chapter_dir)
+            output_name = output_chapter_dir.name
+        else:
+            # Pages are encoded straight into the archive, numbered as they come.
+            dest = output_dir / f"{chapter_path.stem}{output_ext}"
+            total_images = 0
+            with (
+                atomic_output(dest) as temp,
+                ARCHIVERS[output_ext].open_writer(temp) as add,
+            ):
+
+                def save_output(
+                    page_index: int, image_index: int, image: Image.Image
+                ) -> None:
+                    nonlocal total_images
+                    total_images += 1
+                    buffer = io.BytesIO()
+                    encoder.save(image, buffer)
+                    buffer.seek(0)
+                    add(f"{total_images:03}{encoder.extension}", buffer)
+
+                _clamp_pages(
+                    archiver,
+                    page_names,
+                    0,
+                    size_threshold,
+                    process_func,
+                    save_output,
+                    progress_queue,
+                    chapter_path.name,
+                    len(page_names),
+                )
+            output_name = dest.name
+
+        progress_queue.put(
+            {
+                "type": "chapter_done",
+                "chapter_name": chapter_path.name,
+                "total_images": total_images,
+                "output_name": output_name,
+                **digest,
+            }
+        )
+
+    except Exception as e:
+        progress_queue.put(
+            {
+                "type": "error",
+                "chapter_name": chapter_path.name,
+                "message": str(e),
+            }
+        )
+
+
+def _process_page_shard_worker(
+    chapter_path: pathlib.Path,
+    page_names: list[str],
+    first_page: int,
+    total_pages: int,
+    output_chapter_dir: pathlib.Path,
+    size_threshold: int,
+    process_func: Callable[[Iterable[Image.Image], int], Iterable[Image.Image]],
+    encoder: Encoder,
+) -> None:
+    """
+    Worker function to process a contiguous range of pages from one chapter, so that a
+    single large chapter can be spread across the pool. The main process numbers the
+    outputs once every shard of the chapter has reported back.
+    """
+    progress_queue = _worker_progress_channel()
+    try:
+        archiver = archiver_factory(chapter_path)
+        if not archiver:
+            raise ValueError(f"Unsupported file type for {chapter_path.name}")
+        _clamp_pages(
+            archiver,
+            page_names,
+            first_page,
+            size_threshold,
+            process_func,
+            _staged_output_saver(output_chapter_dir, encoder),
+            progress_queue,
+            chapter_path.name,
+            total_pages,
+        )
+        progress_queue.put({"type": "shard_done", "chapter_name": chapter_path.name})
+    except Exception as e:
+        progress_queue.put(
+            {
+                "type": "error",
+                "chapter_name": chapter_path.name,
+                "message": str(e),
+            }
+        )
+
+
+def _split_page_shards(
+    page_names: list[str], num_shards: int
+) -> list[Tuple[list[str], int]]:
+    """Split page_names into up to num_shards contiguous ranges of (page_names, first_page)."""
+    shard_size = math.ceil(len(page_names) / num_shards)
+    return [
+        (page_names[start : start + shard_size], start)
+        for start in range(0, len(page_names), shard_size)
+    ]
+
+
+# ==============================================================
+# CLI GROUP DEFINITION (Both Subcommands)
+# ==============================================================
+
+
+app = typer.Typer(add_completion=True)
+
+
+# ----- CONVERT SUBCOMMAND -----
+@app.command()
+def convert(
+    directories: Annotated[
+        list[pathlib.Path],
+        typer.Argument(
             exists=True, file_okay=False, dir_okay=True, help="Directories to convert."
         ),
     ],
@@ -444,6 +1667,23 @@ def convert(
             ],
         ),
     ],
+    num_workers: Annotated[
+        int,
+        typer.Option(
+            "-w",
+            "--workers",
+            min=1,
+            help="Number of worker processes to use for parallel conversion. Defaults to the number of CPU cores.",
+        ),
+    ] = os.cpu_count() or 1,
+    io_jobs: Annotated[
+        int | None,
+        typer.Option(
+            "--io-jobs",
+            min=1,
+            help="Maximum number of archives being read and written at once. Lower this on a single spinning disk. Defaults to --workers.",
+        ),
+    ] = None,
 ):
     """
     Convert different archive formats (cbr,cbz,etc..).
@@ -470,34 +1710,85 @@ def convert(
         console.print("[blue]No files to convert.[/blue]")
         return
 
-    with Progress(
-        "[progress.description]{task.description}",
-        BarColumn(),
-        "[progress.percentage]{task.percentage:>3.0f}%",
-        TimeElapsedColumn(),
-        TimeRemainingColumn(),
-        console=console,
-    ) as progress:
-        task = progress.add_task("Converting files...", total=len(files_to_convert))
-        for file_path in files_to_convert:
-            progress.update(
-                task, description=f"Converting [bold]{file_path.name}[/bold]"
+    errors: dict[str, str] = {}
+    with ProgressChannel() as progress_queue:
+        io_slot = multiprocessing.Semaphore(io_jobs or num_workers)
+        file_tasks = {}  # To store rich progress sub-task IDs for members within a file
+
+        with Progress(
+            SpinnerColumn("dots2"),
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(bar_width=None),
+            TaskProgressColumn(),
+            MofNCompleteColumn(),
+            TimeElapsedColumn(),
+            TimeRemainingColumn(),
+            console=console,
+        ) as pb:
+            main_task = pb.add_task(
+                "[green]Converting files...[/green]", total=len(files_to_convert)
             )
-            ext = file_path.suffix.lower()
-            try:
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    temp_dir_path = pathlib.Path(temp_dir)
-                    extract_dir = temp_dir_path / "work"
-                    extract_dir.mkdir()
-                    ARCHIVERS[ext](file_path).extract(extract_dir)
-
-                    temp_target = temp_dir_path / (file_path.stem + target_ext)
-                    ARCHIVERS[target_ext].compress(extract_dir, temp_target)
-                    dest = file_path.parent / temp_target.name
-                    shutil.copy(str(temp_target), str(dest))
-            except Exception as e:
-                console.print(f"[red]Error processing {file_path.name}: {e}[/red]")
-            progress.advance(task)
+
+            with ProcessPoolExecutor(
+                max_workers=num_workers,
+                initializer=_init_pool_worker,
+                initargs=(progress_queue, io_slot),
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        _convert_file_worker,
+                        file_path=file_path,
+                        target_ext=target_ext,
+                    )
+                    for file_path in files_to_convert
+                ]
+
+                finished_files_count = 0
+                while finished_files_count < len(files_to_convert):
+                    for message in progress_queue.get():
+                        file_name = message["file_name"]
+
+                        if message["type"] == "member_done":
+                            if file_name not in file_tasks:
+                                file_tasks[file_name] = pb.add_task(
+                                    f"\t[cyan]{file_name}[/cyan]",
+                                    total=message["total_members"],
+                                    parent=main_task,
+                                )
+                            pb.update(
+                                file_tasks[file_name],
+                                advance=1,
+                                description=f"\t[cyan]{file_name} - {message['member_name']}[/cyan]",
+                            )
+                            continue
+
+                        if file_name in file_tasks:
+                            pb.remove_task(file_tasks.pop(file_name))
+                        if message["type"] == "error":
+                            errors[file_name] = message["message"]
+                            description = f"[red]{file_name} failed[/red]"
+                        else:
+                            description = f"[green]{file_name} converted[/green]"
+                        pb.update(main_task, advance=1, description=description)
+                        finished_files_count += 1
+
+                for future in futures:
+                    future.result()
+
+    if errors:
+        from rich.table import Table
+
+        table = Table(
+            title=f"[bold red]{len(errors)} of {len(files_to_convert)} files failed[/bold red]",
+            title_style="none",
+            header_style="bold blue",
+        )
+        table.add_column("File", style="cyan", no_wrap=True)
+        table.add_column("Error", style="red")
+        for file_name, message in errors.items():
+            table.add_row(file_name, message)
+        console.print(table)
+        raise typer.Exit(code=1)
     console.print("[green]Conversion complete.[/green]")
 
 
@@ -537,9 +1828,9 @@ def clamp(
         typer.Option(
             "-a",
             "--approach",
-            help="Approach to enforce size threshold: 'split', 'resize', or 'max-width'",
+            help="Approach to enforce size threshold: 'split', 'gutter' (split between panels), 'resize', or 'max-width'",
             case_sensitive=False,
-            autocompletion=lambda: ["max-width", "resize", "split"],
+            autocompletion=lambda: ["gutter", "max-width", "resize", "split"],
             rich_help_panel="Size Options",
         ),
     ] = "split",
@@ -552,6 +1843,77 @@ def clamp(
             rich_help_panel="Processing Options",
         ),
     ] = os.cpu_count() or 1,  # Ensure default is always an int
+    encoder_name: Annotated[
+        str,
+        typer.Option(
+            "-e",
+            "--encoder",
+            help=f"Output encoder preset. Choices: {list(ENCODERS)}",
+            case_sensitive=False,
+            autocompletion=lambda: list(ENCODERS),
+            rich_help_panel="Output Options",
+        ),
+    ] = "webp",
+    quality: Annotated[
+        int | None,
+        typer.Option(
+            "-q",
+            "--quality",
+            min=0,
+            max=100,
+            help="Override the encoder preset's quality (lossless WebP: compression effort).",
+            rich_help_panel="Output Options",
+        ),
+    ] = None,
+    method: Annotated[
+        int | None,
+        typer.Option(
+            "--method",
+            min=0,
+            max=6,
+            help="Override the WebP method, from 0 (fast) to 6 (small).",
+            rich_help_panel="Output Options",
+        ),
+    ] = None,
+    force: Annotated[
+        bool,
+        typer.Option(
+            "--force",
+            help="Reprocess every chapter, even those the output manifest says are up to date.",
+            rich_help_panel="Processing Options",
+        ),
+    ] = False,
+    content_hash: Annotated[
+        bool,
+        typer.Option(
+            "--hash",
+            help="Fingerprint sources by content hash as well, so touched but unchanged chapters are still skipped.",
+            rich_help_panel="Processing Options",
+        ),
+    ] = False,
+    output_format: Annotated[
+        str,
+        typer.Option(
+            "-f",
+            "--output-format",
+            help=f"Write each chapter as a directory of pages ('dir'), or straight into an archive of this type. Choices: {['dir'] + [i.lstrip('.') for i in ARCHIVERS if i != '/' and i.startswith('.cb')]}",
+            case_sensitive=False,
+            autocompletion=lambda: (
+                ["dir"]
+                + [i.lstrip(".") for i in ARCHIVERS if i != "/" and i.startswith(".cb")]
+            ),
+            rich_help_panel="Output Options",
+        ),
+    ] = "dir",
+    reducing_gap: Annotated[
+        float | None,
+        typer.Option(
+            "--reducing-gap",
+            min=1.0,
+            help="Use the fast downscale path for 'resize' and 'max-width': decode JPEGs at reduced scale and reduce by integer factors down to this multiple of the target size before the final resample. Lower is faster (e.g. 3.0 is near-exact, 1.0 is fastest). Omit for the exact path.",
+            rich_help_panel="Size Options",
+        ),
+    ] = None,
 ):
     """
     clamp image sizes in comic archives to all be under a size threshold.
@@ -565,10 +1927,10 @@ def clamp(
             "[red]Cannot save into the same directory you're reading from[/red]"
         )
         raise typer.Exit(code=1)
-    if approach in ("split", "resize"):
+    if approach in ("split", "gutter", "resize"):
         if size_threshold <= 500000:
             console.print(
-                "[red]For 'split' or 'resize' approach, size_threshold must be > 500,000 pixels[/red]"
+                "[red]For 'split', 'gutter' or 'resize' approach, size_threshold must be > 500,000 pixels[/red]"
             )
             raise typer.Exit(code=1)
     elif approach == "max-width":
@@ -578,11 +1940,36 @@ def clamp(
             )
             raise typer.Exit(code=1)
 
+    encoder_name = encoder_name.lower()
+    if encoder_name not in ENCODERS:
+        console.print(
+            f"[red]Encoder {encoder_name} is not supported by this Pillow build. Choices: {list(ENCODERS)}[/red]"
+        )
+        raise typer.Exit(code=1)
+    encoder = ENCODERS[encoder_name].with_overrides(quality=quality, method=method)
+
+    # None means a directory per chapter; otherwise the suffix of the archive to write.
+    output_ext: str | None = None
+    if output_format.lower() != "dir":
+        output_ext = f".{output_format.lower()}"
+        if output_ext not in ARCHIVERS or output_ext == "/":
+            console.print(f"[red]Output format {output_format} is not supported.[/red]")
+            raise typer.Exit(code=1)
+        if ARCHIVERS[output_ext] is ArchiveCBR:
+            try:
+                ArchiveCBR._require_rar()
+            except RuntimeError as e:
+                console.print(f"[red]{e}[/red]")
+                raise typer.Exit(code=1) from e
+
     # Map approach names to processing functions.
-    process_func: Callable[[Iterable[Image.Image], int], list[Image.Image]] = {
+    process_func: Callable[[Iterable[Image.Image], int], Iterable[Image.Image]] = {
         "split": split_images,
-        "resize": resize_images,
-        "max-width": resize_images_by_width,
+        "gutter": split_images_at_gutters,
+        "resize": functools.partial(resize_images, reducing_gap=reducing_gap),
+        "max-width": functools.partial(
+            resize_images_by_width, reducing_gap=reducing_gap
+        ),
     }[approach]
 
     # Determine items to process: either a single file or all files in a directory
@@ -598,10 +1985,47 @@ def clamp(
         console.print("[blue]No supported files or directories to process.[/blue]")
         return
 
-    # Use a multiprocessing Manager to create a queue for progress updates
-    with Manager() as manager:
-        progress_queue = manager.Queue()
-        image_tasks = {}  # To store rich progress sub-task IDs for images within a chapter
+    # Skip chapters whose output was produced from the same source with the same parameters.
+    manifest = ClampManifest(output_dir)
+    params = {
+        "approach": approach,
+        "size_threshold": size_threshold,
+        "encoder": encoder.name,
+        "encoder_options": dict(encoder.options),
+    }
+    if reducing_gap is not None and approach not in ("split", "gutter"):
+        params["reducing_gap"] = reducing_gap
+    if output_ext is not None:
+        params["output_format"] = output_ext
+    if not force:
+        up_to_date = [
+            chapter_path
+            for chapter_path in chapters_to_process
+            if manifest.is_current(chapter_path, params, content_hash)
+        ]
+        if up_to_date:
+            console.print(
+                f"[blue]Skipping {len(up_to_date)} unchanged chapter(s) already in {output_dir}.[/blue]"
+            )
+            chapters_to_process = [
+                chapter_path
+                for chapter_path in chapters_to_process
+                if chapter_path not in up_to_date
+            ]
+            if not chapters_to_process:
+                console.print("[green]All chapters are up to date.[/green]")
+                return
+
+    # Fingerprint before processing, so edits made mid-run are picked up next time. With
+    # content_hash, workers hash their chapter before reading it and send the digest back.
+    fingerprints = {
+        chapter_path.name: source_fingerprint(chapter_path)
+        for chapter_path in chapters_to_process
+    }
+
+    # Workers report progress through a batched channel rather than one IPC call per page
+    with ProgressChannel() as progress_queue, manifest:
+        image_tasks = {}  # To store rich progress sub-task IDs for pages within a chapter
 
         with Progress(
             SpinnerColumn("dots2"),
@@ -619,7 +2043,16 @@ def clamp(
             )
 
             # Submit tasks to the ProcessPoolExecutor
-            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            with ProcessPoolExecutor(
+                max_workers=num_workers,
+                initializer=_init_pool_worker,
+                initargs=(progress_queue,),
+            ) as executor:
+                # With fewer chapters than workers, each chapter's worker splits the pages
+                # of a chapter that needs processing into shards for the rest of the pool.
+                shards_per_chapter = math.ceil(num_workers / len(chapters_to_process))
+                pending_shards: dict[str, int] = {}
+                chapter_paths = {path.name: path for path in chapters_to_process}
                 futures = [
                     executor.submit(
                         _process_chapter_item_worker,
@@ -627,53 +2060,156 @@ def clamp(
                         output_dir=output_dir,
                         size_threshold=size_threshold,
                         process_func=process_func,
-                        progress_queue=progress_queue,
                         approach=approach,
+                        encoder=encoder,
+                        output_ext=output_ext,
+                        num_shards=shards_per_chapter,
+                        content_hash=content_hash,
                     )
                     for chapter_path in chapters_to_process
                 ]
+                failed_chapters: set[str] = set()
 
                 # Monitor the queue for progress updates
                 processed_chapters_count = 0
                 while processed_chapters_count < len(chapters_to_process):
-                    message = progress_queue.get()
-                    chapter_name = message["chapter_name"]
-
-                    if message["type"] == "image_saved":
-                        if chapter_name not in image_tasks:
-                            # Create a new sub-task for this chapter's images if it doesn't exist
-                            image_tasks[chapter_name] = pb.add_task(
-                                f"\t[cyan]{chapter_name}[/cyan]",
-                                total=message["total_images"],
-                                parent=main_task,
-                                visible=True,
+                    for message in progress_queue.get():
+                        chapter_name = message["chapter_name"]
+                        if "blake2b" in message:
+                            fingerprints[chapter_name]["blake2b"] = message["blake2b"]
+
+                        if chapter_name in failed_chapters:
+                            # Remaining shards of a chapter that already failed. Once the
+                            # last one is in, nothing writes to its staging directory.
+                            if message["type"] in ("shard_done", "error"):
+                                pending_shards[chapter_name] -= 1
+                                if not pending_shards[chapter_name]:
+                                    shutil.rmtree(
+                                        _chapter_staging_dir(
+                                            output_dir,
+                                            pathlib.Path(chapter_name).stem,
+                                            archived=output_ext is not None,
+                                        ),
+                                        ignore_errors=True,
+                                    )
+                            continue
+                        if message["type"] == "shards":
+                            # The chapter's worker probed it and kept the first shard.
+                            pending_shards[chapter_name] = len(message["shards"]) + 1
+                            stem = pathlib.Path(chapter_name).stem
+                            futures.extend(
+                                executor.submit(
+                                    _process_page_shard_worker,
+                                    chapter_path=chapter_paths[chapter_name],
+                                    page_names=names,
+                                    first_page=first_page,
+                                    total_pages=message["total_pages"],
+                                    output_chapter_dir=_chapter_staging_dir(
+                                        output_dir,
+                                        stem,
+                                        archived=output_ext is not None,
+                                    ),
+                                    size_threshold=size_threshold,
+                                    process_func=process_func,
+                                    encoder=encoder,
+                                )
+                                for names, first_page in message["shards"]
+                            )
+                            continue
+                        if message["type"] == "shard_done":
+                            pending_shards[chapter_name] -= 1
+                            if pending_shards[chapter_name]:
+                                continue
+                            # Every shard is in, so outputs can now be numbered in page order.
+                            try:
+                                stem = pathlib.Path(chapter_name).stem
+                                if output_ext is None:
+                                    output_name = stem
+                                    total_images = _finalize_chapter_pages(
+                                        output_dir / output_name
+                                    )
+                                else:
+                                    output_name = f"{stem}{output_ext}"
+                                    total_images = _pack_chapter_pages(
+                                        _chapter_staging_dir(
+                                            output_dir, stem, archived=True
+                                        ),
+                                        ARCHIVERS[output_ext],
+                                        output_dir / output_name,
+                                    )
+                                message = {
+                                    "type": "chapter_done",
+                                    "chapter_name": chapter_name,
+                                    "total_images": total_images,
+                                    "output_name": output_name,
+                                }
+                            except Exception as e:
+                                message = {
+                                    "type": "error",
+                                    "chapter_name": chapter_name,
+                                    "message": str(e),
+                                }
+
+                        if message["type"] == "page_done":
+                            if chapter_name not in image_tasks:
+                                # Create a new sub-task for this chapter's pages if it doesn't exist
+                                image_tasks[chapter_name] = pb.add_task(
+                                    f"\t[cyan]{chapter_name}[/cyan]",
+                                    total=message["total_pages"],
+                                    parent=main_task,
+                                    visible=True,
+                                )
+                            pb.update(
+                                image_tasks[chapter_name],
+                                advance=1,
+                                description=f"\t[cyan]{chapter_name} - {message['page_name']}[/cyan]",
+                            )
+                        elif message["type"] == "chapter_done":
+                            manifest.record(
+                                chapter_name,
+                                fingerprints[chapter_name],
+                                params,
+                                message["total_images"],
+                                message["output_name"],
+                            )
+                            manifest.checkpoint()
+                            if chapter_name in image_tasks:
+                                pb.remove_task(image_tasks[chapter_name])
+                                del image_tasks[chapter_name]
+                            pb.update(
+                                main_task,
+                                advance=1,
+                                description=f"[green]{chapter_name} processed[/green]",
+                            )
+                            processed_chapters_count += 1
+                        elif message["type"] == "error":
+                            manifest.discard(chapter_name)
+                            if chapter_name in pending_shards:
+                                # Drop the pages staged so far, as atomic_output does for a
+                                # whole chapter. Shards still running are cleaned up after.
+                                failed_chapters.add(chapter_name)
+                                if pending_shards[chapter_name]:
+                                    pending_shards[chapter_name] -= 1
+                                shutil.rmtree(
+                                    _chapter_staging_dir(
+                                        output_dir,
+                                        pathlib.Path(chapter_name).stem,
+                                        archived=output_ext is not None,
+                                    ),
+                                    ignore_errors=True,
+                                )
+                            if chapter_name in image_tasks:
+                                pb.remove_task(image_tasks.pop(chapter_name))
+                            console.print(
+                                f"[red]Error processing {chapter_name}: {message['message']}[/red]"
                             )
-                        pb.update(
-                            image_tasks[chapter_name],
-                            advance=1,
-                            description=f"\t[cyan]{chapter_name} - {message['image_filename']}[/cyan]",
-                        )
-                    elif message["type"] == "chapter_done":
-                        if chapter_name in image_tasks:
-                            pb.remove_task(image_tasks[chapter_name])
-                            del image_tasks[chapter_name]
-                        pb.update(
-                            main_task,
-                            advance=1,
-                            description=f"[green]{chapter_name} processed[/green]",
-                        )
-                        processed_chapters_count += 1
-                    elif message["type"] == "error":
-                        console.print(
-                            f"[red]Error processing {chapter_name}: {message['message']}[/red]"
-                        )
-                        # Still advance the main task for errors to ensure progress completes
-                        pb.update(
-                            main_task,
-                            advance=1,
-                            description=f"[red]{chapter_name} failed[/red]",
-                        )
-                        processed_chapters_count += 1
+                            # Still advance the main task for errors to ensure progress completes
+                            pb.update(
+                                main_task,
+                                advance=1,
+                                description=f"[red]{chapter_name} failed[/red]",
+                            )
+                            processed_chapters_count += 1
 
                 # Ensure all futures are completed (even if errors occurred)
                 for future in futures:
@@ -683,41 +2219,522 @@ def clamp(
 
 
 # ----- CREATE-CHAPTERS SUBCOMMAND -----
-def complete_chapter_break_images(ctx: typer.Context, incomplete: str):
+def _dhash_bits(thumbnails: "np.ndarray") -> "np.ndarray":
+    """dHash: whether each pixel is brighter than its left neighbour, on 9x8 thumbnails."""
+    return thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+
+
+def _phash_bits(thumbnails: "np.ndarray") -> "np.ndarray":
+    """pHash: low 8x8 DCT coefficients above their median, on 32x32 thumbnails."""
+    import numpy as np
+
+    n = thumbnails.shape[-1]
+    k = np.arange(n)
+    dct = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    low = (dct @ thumbnails @ dct.T)[:, :8, :8].reshape(len(thumbnails), -1)
+    # The DC term only tracks overall brightness, so leave it out of the median.
+    return low > np.median(low[:, 1:], axis=1, keepdims=True)
+
+
+# Thumbnail size (width, height) and bit function for each perceptual hash.
+PERCEPTUAL_HASHES: Dict[str, Tuple[Tuple[int, int], Callable]] = {
+    "dhash": ((9, 8), _dhash_bits),
+    "phash": ((32, 32), _phash_bits),
+}
+
+
+def load_hash_thumbnail(fp: IO[bytes], method: str) -> "np.ndarray":
+    """Decode a page as the small grayscale thumbnail a perceptual hash is computed from."""
+    import numpy as np
+
+    size, _ = PERCEPTUAL_HASHES[method]
+    with Image.open(fp) as img:
+        # JPEGs can be decoded straight at a fraction of their size.
+        img.draft("L", (size[0] * 8, size[1] * 8))
+        thumbnail = img.convert("L").resize(size, Image.Resampling.BOX)
+    return np.asarray(thumbnail, dtype=np.float32)
+
+
+def perceptual_hashes(thumbnails: "np.ndarray", method: str) -> "np.ndarray":
+    """64-bit perceptual hashes (as uint64) for a stack of thumbnails from load_hash_thumbnail."""
+    import numpy as np
+
+    _, bits = PERCEPTUAL_HASHES[method]
+    packed = np.packbits(bits(thumbnails).reshape(len(thumbnails), 64), axis=1)
+    return packed.view(">u8").ravel().astype(np.uint64)
+
+
+def hamming_distances(hashes: "np.ndarray", targets: "np.ndarray") -> "np.ndarray":
+    """Bitwise Hamming distance between every hash and every target, shape (hashes, targets)."""
+    import numpy as np
+
+    xor = (hashes[:, None] ^ targets[None, :]).astype(">u8")
+    return np.unpackbits(xor.view(np.uint8), axis=-1).reshape(*xor.shape, 64).sum(-1)
+
+
+# Shorter side pages are resized to before the embedding model's center crop.
+EMBEDDING_RESIZE = 256
+
+
+def decode_for_embedding(
+    img: Image.Image, short_side: int | None = EMBEDDING_RESIZE
+) -> Image.Image:
     """
-    Provide autocompletion for chapter break images.
+    Decode a page as RGB at the lowest resolution that still has short_side pixels on its
+    shorter edge (or in full, with None). JPEGs are decoded at reduced scale (draft mode),
+    other formats are reduced by an integer factor down to twice that size, like
+    Image.thumbnail, and grayscale pages are only expanded to RGB once they are small.
     """
-    input_dir = ctx.params.get("input_dir")
-    if not input_dir or not os.path.isdir(input_dir):
-        return []
-
-    try:
-        all_files = os.listdir(input_dir)
-        image_files = [
-            f
-            for f in all_files
-            if os.path.splitext(f)[1].lower() in IMG_EXTENSIONS
-            and f.startswith(incomplete)
+    if short_side is not None and min(img.size) > short_side:
+        scale = short_side / min(img.size)
+        img.draft(None, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        if img.mode not in ("L", "RGB"):
+            # Palette and other modes can't be averaged directly.
+            img = img.convert("RGB")
+        factor = min(img.size) // (2 * short_side)
+        if factor > 1:
+            img = img.reduce(factor)
+    return img.convert("RGB")
+
+
+def embedding_transform() -> Callable[[Image.Image], "torch.Tensor"]:
+    """Preprocessing applied to every decoded page before it is embedded."""
+    from torchvision import transforms
+
+    return transforms.Compose(
+        [
+            transforms.Resize(EMBEDDING_RESIZE),
+            transforms.CenterCrop(224),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
         ]
+    )
 
-        # Deduplicate based on already provided images
-        provided_images = ctx.params.get("chapter_break_images") or []
 
-        return [img for img in image_files if img not in provided_images]
-    except OSError:
-        return []
+def embedding_model_id() -> str:
+    """Identity of the embedding model's architecture and weights."""
+    from torchvision.models import efficientnet
 
+    return f"efficientnet_b0:{efficientnet.EfficientNet_B0_Weights.DEFAULT}"
 
-@app.command(
-    name="create-chapters",
-    help="Faster chapter splitting via batching with multiple target images using AI feature extraction.",
-)
-def create_chapters_command(
-    input_dir: Annotated[
-        str,
+
+def load_embedding_model() -> "torch.nn.Module":
+    """EfficientNet-B0 features plus global average pooling, in eval mode."""
+    import torch.nn as nn
+    from torchvision import models
+    from torchvision.models import efficientnet
+
+    backbone = models.efficientnet_b0(
+        weights=efficientnet.EfficientNet_B0_Weights.DEFAULT
+    )
+    return nn.Sequential(
+        backbone.features,
+        nn.AdaptiveAvgPool2d(1),
+        nn.Flatten(),
+    ).eval()
+
+
+def load_page_batches(
+    archiver: "ArchiveBase",
+    names: list[str],
+    transform: Callable[[Image.Image], "torch.Tensor"],
+    batch_size: int,
+    max_batches: int | None = None,
+    short_side: int | None = EMBEDDING_RESIZE,
+) -> list["torch.Tensor"]:
+    """Preprocess pages into batches in memory, for tracing, calibration and benchmarks."""
+    import torch
+
+    if max_batches is not None:
+        names = names[: batch_size * max_batches]
+    pages = [
+        transform(decode_for_embedding(img, short_side))
+        for _, img in archiver.iter_pages(names)
+    ]
+    return [
+        torch.stack(pages[start : start + batch_size])
+        for start in range(0, len(pages), batch_size)
+    ]
+
+
+# An inference backend takes the eval-mode fp32 embedding model and a few sample batches
+# (for tracing or calibration) and returns a function from a batch of pages to embeddings.
+InferenceBackend = Callable[
+    ["torch.nn.Module", list["torch.Tensor"]],
+    Callable[["torch.Tensor"], "torch.Tensor"],
+]
+B = TypeVar("B", bound=InferenceBackend)
+
+INFERENCE_BACKENDS: Dict[str, InferenceBackend] = {}
+# Backends that only run on the CPU, whatever device is available.
+CPU_ONLY_BACKENDS = {"int8", "onnx"}
+
+
+def register_backend(name: str) -> Callable[[B], B]:
+    """Decorator to register inference backends."""
+
+    def register(backend: B) -> B:
+        INFERENCE_BACKENDS[name] = backend
+        return backend
+
+    return register
+
+
+@register_backend("eager")
+def _eager_backend(
+    model: "torch.nn.Module", samples: list["torch.Tensor"]
+) -> Callable[["torch.Tensor"], "torch.Tensor"]:
+    return model
+
+
+@register_backend("channels-last")
+def _channels_last_backend(
+    model: "torch.nn.Module", samples: list["torch.Tensor"]
+) -> Callable[["torch.Tensor"], "torch.Tensor"]:
+    """NHWC weights and inputs, which oneDNN convolutions run faster on."""
+    import torch
+
+    model = model.to(memory_format=torch.channels_last)
+
+    def run(batch: "torch.Tensor") -> "torch.Tensor":
+        return model(batch.contiguous(memory_format=torch.channels_last))
+
+    return run
+
+
+@register_backend("torchscript")
+def _torchscript_backend(
+    model: "torch.nn.Module", samples: list["torch.Tensor"]
+) -> Callable[["torch.Tensor"], "torch.Tensor"]:
+    """Traced and frozen, so conv/batch-norm pairs are folded and ops fused."""
+    import torch
+
+    with torch.no_grad():
+        return torch.jit.optimize_for_inference(torch.jit.trace(model, samples[0]))
+
+
+@register_backend("compile")
+def _compile_backend(
+    model: "torch.nn.Module", samples: list["torch.Tensor"]
+) -> Callable[["torch.Tensor"], "torch.Tensor"]:
+    """torch.compile with the default Inductor backend. Compiles on the first batch."""
+    import torch
+
+    return torch.compile(model)
+
+
+@register_backend("int8")
+def _int8_backend(
+    model: "torch.nn.Module", samples: list["torch.Tensor"]
+) -> Callable[["torch.Tensor"], "torch.Tensor"]:
+    """Static int8 quantization (FX graph mode), calibrated on the sample batches."""
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    prepared = prepare_fx(
+        copy.deepcopy(model), get_default_qconfig_mapping("x86"), (samples[0],)
+    )
+    with torch.no_grad():
+        for batch in samples:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+@register_backend("onnx")
+def _onnx_backend(
+    model: "torch.nn.Module", samples: list["torch.Tensor"]
+) -> Callable[["torch.Tensor"], "torch.Tensor"]:
+    """Exported to ONNX and run by ONNX Runtime on the CPU."""
+    import torch
+
+    try:
+        import onnxruntime
+    except ImportError as err:
+        raise RuntimeError(
+            "onnxruntime is not installed; cannot use the onnx backend."
+        ) from err
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        model_path = os.path.join(temp_dir, "embedding.onnx")
+        torch.onnx.export(
+            model,
+            (samples[0],),
+            model_path,
+            input_names=["pages"],
+            output_names=["embeddings"],
+            dynamic_axes={"pages": {0: "batch"}, "embeddings": {0: "batch"}},
+        )
+        session = onnxruntime.InferenceSession(
+            model_path, providers=["CPUExecutionProvider"]
+        )
+
+    def run(batch: "torch.Tensor") -> "torch.Tensor":
+        (embeddings,) = session.run(None, {"pages": batch.numpy()})
+        return torch.from_numpy(embeddings)
+
+    return run
+
+
+R = TypeVar("R")
+
+
+def map_members(
+    archiver: "ArchiveBase",
+    names: list[str],
+    func: Callable[[IO[bytes]], R],
+    workers: int,
+) -> Iterator[R]:
+    """
+    Yield func(member) for each of names, in order. Members are read one after another
+    (so solid archives are decompressed in a single pass) and func runs on a thread pool,
+    with a bounded number of members in memory at once.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: list = []
+        for _, fp in archiver.iter_members(names):
+            pending.append(executor.submit(func, io.BytesIO(fp.read())))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def write_chapter_zips(
+    archiver: "ArchiveBase",
+    chapters: Iterable[list[str]],
+    output_dir: pathlib.Path,
+    workers: int,
+) -> Iterator[pathlib.Path]:
+    """
+    Write each chapter (a list of page names) to output_dir/"Chapter NNN.cbz" by copying
+    the original member bytes, and yield each path once written. Chapters must be
+    consecutive runs of the archive's pages, and may be produced lazily: each is started
+    as soon as it arrives. Zip sources are copied still compressed, several chapters at a
+    time; other sources are read in one sequential pass, so solid archives aren't
+    decompressed from the start for every chapter.
+    """
+    dests = (output_dir / f"Chapter {idx:03d}.cbz" for idx in itertools.count(1))
+    if isinstance(archiver, ArchiveCBZ):
+
+        def copy_chapter(dest: pathlib.Path, names: list[str]) -> pathlib.Path:
+            with atomic_output(dest) as temp:
+                archiver.copy_raw(temp, names)
+            return dest
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending: list = []
+            for dest, names in zip(dests, chapters, strict=False):
+                pending.append(executor.submit(copy_chapter, dest, names))
+                while pending and pending[0].done():
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+        return
+
+    members = archiver.iter_members()
+    for dest, names in zip(dests, chapters, strict=False):
+        with (
+            atomic_output(dest) as temp,
+            zipfile.ZipFile(temp, "w", compression=zipfile.ZIP_STORED) as zf,
+        ):
+            for name, (member_name, fp) in zip(
+                names, itertools.islice(members, len(names)), strict=True
+            ):
+                if member_name != name:
+                    raise ValueError(
+                        f"Chapters must be consecutive runs of pages; expected {member_name}, got {name}"
+                    )
+                with zf.open(name, "w") as out:
+                    shutil.copyfileobj(fp, out)
+        yield dest
+
+
+def default_cache_dir() -> pathlib.Path:
+    """Per-user cache directory for comic_book, following XDG_CACHE_HOME."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(cache_home) / "comic_book"
+
+
+def content_digest(fp: IO[bytes]) -> str:
+    """Content hash identifying a page independently of its name or location."""
+    digest = hashlib.blake2b(digest_size=16)
+    while chunk := fp.read(1 << 20):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent page embeddings for create-chapters, keyed by page content hash.
+
+    Each model/preprocessing config gets its own store under root: a float16 matrix
+    (embeddings.f16, one row per page, read through a memory map) and index.json mapping
+    content hashes to rows. Rows are appended before the index that points at them is
+    replaced, so an interrupted run never leaves the index pointing past the data.
+    """
+
+    VERSION = 1
+    DTYPE = "<f2"
+    # Every add rewrites the index, so incremental writers should add about this many rows at once.
+    FLUSH_ROWS = 4096
+
+    def __init__(self: Self, root: pathlib.Path, config: Mapping[str, object]) -> None:
+        self.config = dict(config)
+        key = hashlib.blake2b(
+            json.dumps(self.config, sort_keys=True).encode(), digest_size=8
+        ).hexdigest()
+        self.dir = root / key
+        self.index_path = self.dir / "index.json"
+        self.data_path = self.dir / "embeddings.f16"
+        self.rows: dict[str, int] = {}
+        self.dim: int | None = None
+        try:
+            data = json.loads(self.index_path.read_text())
+            if (
+                data.get("version") == self.VERSION
+                and data.get("config") == self.config
+            ):
+                self.rows = data["rows"]
+                self.dim = data["dim"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            # Missing or unreadable indexes just mean everything gets embedded.
+            pass
+
+    def __contains__(self: Self, digest: str) -> bool:
+        return digest in self.rows
+
+    def __len__(self: Self) -> int:
+        return len(self.rows)
+
+    def add(self: Self, digests: list[str], embeddings: "np.ndarray") -> None:
+        """Store one embedding row per digest; digests already present are skipped."""
+        if self.dim is not None and embeddings.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding size {embeddings.shape[1]} does not match the cache ({self.dim})"
+            )
+        seen = set(self.rows)
+        new = []
+        for i, digest in enumerate(digests):
+            if digest not in seen:
+                seen.add(digest)
+                new.append(i)
+        if not new:
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.dim = embeddings.shape[1]
+        with open(self.data_path, "ab") as fp:
+            # Drop rows from an interrupted run that the index never pointed at.
+            fp.truncate(len(self.rows) * self.dim * 2)
+            fp.write(embeddings[new].astype(self.DTYPE).tobytes())
+        for row, i in enumerate(new, len(self.rows)):
+            self.rows[digests[i]] = row
+        temp = self.index_path.with_name(
+            f"{self.index_path.name}.{os.getpid()}.partial"
+        )
+        temp.write_text(
+            json.dumps(
+                {
+                    "version": self.VERSION,
+                    "config": self.config,
+                    "dim": self.dim,
+                    "rows": self.rows,
+                }
+            )
+        )
+        os.replace(temp, self.index_path)
+
+    def get(self: Self, digests: Iterable[str]) -> "np.ndarray":
+        """Return the float32 embeddings for digests, which must all be in the cache."""
+        import numpy as np
+
+        rows = [self.rows[digest] for digest in digests]
+        if not rows:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        matrix = np.memmap(
+            self.data_path, dtype=self.DTYPE, mode="r", shape=(len(self.rows), self.dim)
+        )
+        return np.asarray(matrix[rows], dtype=np.float32)
+
+
+def top_k_similarities(
+    pages: "np.ndarray",
+    targets: "np.ndarray",
+    k: int = 1,
+    block_size: int = 1024,
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    The k best cosine similarities of each (unit length) page embedding against targets,
+    best first, as (scores, target indices), each of shape (pages, k). Similarities are
+    computed in float32 for block_size pages against block_size targets at a time and only
+    the running top k is kept, so pages and targets can be float16 memory maps of any size.
+    """
+    import numpy as np
+
+    k = min(k, len(targets))
+    scores = np.empty((len(pages), k), dtype=np.float32)
+    indices = np.empty((len(pages), k), dtype=np.intp)
+    for start in range(0, len(pages), block_size):
+        block = np.asarray(pages[start : start + block_size], dtype=np.float32)
+        best = np.full((len(block), k), -np.inf, dtype=np.float32)
+        best_idx = np.zeros((len(block), k), dtype=np.intp)
+        for target_start in range(0, len(targets), block_size):
+            target_block = np.asarray(
+                targets[target_start : target_start + block_size], dtype=np.float32
+            )
+            sims = np.concatenate([best, block @ target_block.T], axis=1)
+            idx = np.concatenate(
+                [
+                    best_idx,
+                    np.broadcast_to(
+                        np.arange(target_start, target_start + len(target_block)),
+                        (len(block), len(target_block)),
+                    ),
+                ],
+                axis=1,
+            )
+            keep = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            best = np.take_along_axis(sims, keep, axis=1)
+            best_idx = np.take_along_axis(idx, keep, axis=1)
+        order = np.argsort(-best, axis=1, kind="stable")
+        scores[start : start + len(block)] = np.take_along_axis(best, order, axis=1)
+        indices[start : start + len(block)] = np.take_along_axis(
+            best_idx, order, axis=1
+        )
+    return scores, indices
+
+
+def complete_chapter_break_images(ctx: typer.Context, incomplete: str):
+    """
+    Provide autocompletion for chapter break images.
+    """
+    input_dir = ctx.params.get("input_dir")
+    archiver = archiver_factory(pathlib.Path(input_dir)) if input_dir else None
+    if archiver is None or not archiver.path.exists():
+        return []
+
+    try:
+        image_files = [f for f in archiver.page_names() if f.startswith(incomplete)]
+
+        # Deduplicate based on already provided images
+        provided_images = ctx.params.get("chapter_break_images") or []
+
+        return [img for img in image_files if img not in provided_images]
+    except Exception:
+        # Unreadable archives just mean no completions.
+        return []
+
+
+@app.command(
+    name="create-chapters",
+    help="Faster chapter splitting via batching with multiple target images using AI feature extraction.",
+)
+def create_chapters_command(
+    input_dir: Annotated[
+        str,
         typer.Argument(
             ...,
-            help="Path to the directory containing comic images.",
+            help="Path to the directory containing comic images, or a comic archive.",
             rich_help_panel="Input Options",
         ),
     ],
@@ -725,7 +2742,7 @@ def create_chapters_command(
         list[str],
         typer.Argument(
             ...,
-            help="Filenames of images within the input directory that mark chapter breaks.",
+            help="Filenames of images within the input directory or archive that mark chapter breaks.",
             rich_help_panel="Input Options",
             autocompletion=complete_chapter_break_images,
         ),
@@ -760,13 +2777,69 @@ def create_chapters_command(
         help="Plot similarity values and exit.",
         rich_help_panel="Output Options",
     ),
+    extra_volumes: Annotated[
+        list[str] | None,
+        typer.Option(
+            "--volume",
+            "-V",
+            help="Another directory or archive to split with the same targets and loaded model (repeatable). With --output-dir, each volume's chapters go to a subdirectory named after it.",
+            rich_help_panel="Input Options",
+        ),
+    ] = None,
+    stream: bool = typer.Option(
+        False,
+        "--stream",
+        help="Score pages as they come out of the model and write each chapter as soon as the next break is found, while inference continues.",
+        rich_help_panel="Output Options",
+    ),
+    prefilter: str | None = typer.Option(
+        None,
+        help=f"Only run pages whose perceptual hash is close to a target's through the CNN. Choices: {list(PERCEPTUAL_HASHES)}",
+        autocompletion=lambda: list(PERCEPTUAL_HASHES),
+        rich_help_panel="Prefilter Options",
+    ),
+    prefilter_distance: int = typer.Option(
+        20,
+        min=0,
+        max=64,
+        help="Maximum Hamming distance (out of 64 bits) from a target hash for a page to be kept.",
+        rich_help_panel="Prefilter Options",
+    ),
+    prefilter_audit: int = typer.Option(
+        32,
+        min=0,
+        help="Number of rejected pages to run through the CNN anyway, to estimate the prefilter's recall.",
+        rich_help_panel="Prefilter Options",
+    ),
+    backend: str = typer.Option(
+        "eager",
+        help=f"Inference backend for the embedding model. Choices: {list(INFERENCE_BACKENDS)}. 'bench inference' compares their speed and drift on your pages.",
+        autocompletion=lambda: list(INFERENCE_BACKENDS),
+        rich_help_panel="Processing Options",
+    ),
+    full_decode: bool = typer.Option(
+        False,
+        "--full-decode",
+        help="Decode pages at full resolution before resizing, instead of at the reduced scale the model needs.",
+        rich_help_panel="Processing Options",
+    ),
+    cache_dir: str | None = typer.Option(
+        None,
+        help="Where page embeddings are cached between runs. Defaults to $XDG_CACHE_HOME/comic_book/embeddings.",
+        rich_help_panel="Processing Options",
+    ),
+    use_cache: bool = typer.Option(
+        True,
+        "--cache/--no-cache",
+        help="Reuse cached page embeddings and store new ones.",
+        rich_help_panel="Processing Options",
+    ),
 ):
     """
     Identifies chapter breaks in a directory of comic images based on similarity to target images
     and creates CBZ archives for each chapter.
     """
     import numpy as np
-    import pandas as pd
     import plotext as plt  # type: ignore
     import torch
     import torch.nn as nn
@@ -780,33 +2853,160 @@ def create_chapters_command(
         TimeRemainingColumn,
     )
     from rich.table import Table
-    from torch.utils.data import DataLoader, Dataset
-    from torchvision import models, transforms
-    from torchvision.models import efficientnet
-
-    class ImageDataset(Dataset):
-        def __init__(self, filepaths, transform):
-            self.filepaths = filepaths
+    from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+    class PageDataset(IterableDataset):
+        """
+        (archiver, name) pages streamed from any number of archives or directories, so no
+        archive is ever extracted to disk and batches run across volume boundaries. Loader
+        worker w reads batches w, w + num_workers, ... and the loader collects batches from
+        its workers in turn, so they arrive in page order.
+
+        Solid archives would be decompressed once per worker that way, so their pages are
+        read in a single pass by `feed`, on a thread of the main process, and each page's
+        bytes are queued for the worker that decodes it.
+        """
+
+        def __init__(self, pages, transform, short_side, batch_size, num_workers):
+            self.pages = pages
             self.transform = transform
+            self.short_side = short_side
+            self.batch_size = batch_size
+            self.solid = {
+                archiver
+                for archiver in {archiver for archiver, _ in pages}
+                if archiver.is_solid()
+            }
+            # A worker never holds more than a couple of batches it hasn't been asked for.
+            self.queues = (
+                [
+                    multiprocessing.Queue(maxsize=2 * batch_size)
+                    for _ in range(num_workers)
+                ]
+                if self.solid and num_workers
+                else []
+            )
 
         def __len__(self):
-            return len(self.filepaths)
+            return len(self.pages)
+
+        def feed(self, stop: threading.Event) -> None:
+            """Read the solid archives' pages and queue them for their workers."""
+            indexed = [
+                (index, page)
+                for index, page in enumerate(self.pages)
+                if page[0] in self.solid
+            ]
+
+            def put(worker_queue, item: Tuple[str | None, bytes | str]) -> bool:
+                while not stop.is_set():
+                    try:
+                        worker_queue.put(item, timeout=0.1)
+                        return True
+                    except queue.Full:
+                        pass
+                return False
 
-        def __getitem__(self, idx):
-            path = self.filepaths[idx]
-            img = Image.open(path).convert("RGB")
-            return self.transform(img), os.path.basename(path)
+            try:
+                for archiver, group in itertools.groupby(
+                    indexed, key=lambda item: item[1][0]
+                ):
+                    group = list(group)
+                    members = archiver.iter_members([name for _, (_, name) in group])
+                    for (index, _), (name, fp) in zip(group, members, strict=True):
+                        worker_queue = self.queues[
+                            index // self.batch_size % len(self.queues)
+                        ]
+                        if not put(worker_queue, (name, fp.read())):
+                            return
+            except Exception as err:
+                # Fail the next page of every worker, so none waits forever.
+                for worker_queue in self.queues:
+                    put(worker_queue, (None, f"{type(err).__name__}: {err}"))
+
+        def __iter__(self):
+            indexed = list(enumerate(self.pages))
+            worker = get_worker_info()
+            if worker is not None:
+                stride = worker.num_workers * self.batch_size
+                indexed = [
+                    item
+                    for start in range(
+                        worker.id * self.batch_size, len(indexed), stride
+                    )
+                    for item in indexed[start : start + self.batch_size]
+                ]
+            # Consecutive pages of one volume are read in a single pass over it.
+            for archiver, group in itertools.groupby(
+                indexed, key=lambda item: item[1][0]
+            ):
+                names = [name for _, (_, name) in group]
+                if archiver in self.solid and self.queues:
+                    images = self._queued_pages(self.queues[worker.id], names)
+                else:
+                    images = archiver.iter_pages(names)
+                while True:
+                    # Time reading, decoding and preprocessing, to report loader throughput.
+                    start = time.perf_counter()
+                    try:
+                        name, img = next(images)
+                    except StopIteration:
+                        break
+                    page = self.transform(decode_for_embedding(img, self.short_side))
+                    yield page, name, time.perf_counter() - start
+
+        @staticmethod
+        def _queued_pages(worker_queue, names):
+            """Like iter_pages, for pages whose bytes `feed` queues for this worker."""
+            for name in names:
+                queued_name, data = worker_queue.get()
+                if queued_name is None:
+                    raise RuntimeError(f"Reading {name} failed: {data}")
+                if queued_name != name:
+                    raise RuntimeError("Pages were queued out of order")
+                with Image.open(io.BytesIO(data)) as img:
+                    yield name, img
+
+    @dataclass
+    class Volume:
+        """One input of create-chapters and the pages selected from it for embedding."""
+
+        archiver: ArchiveBase
+        output_dir: pathlib.Path
+        files: list[str]
+        # Indices into files of the pages to embed.
+        selected: list[int] = field(default_factory=list)
+        audit: list[int] = field(default_factory=list)
+        rejected_count: int = 0
+        digests: list[str] = field(default_factory=list)
+
+        @property
+        def names(self) -> list[str]:
+            return [self.files[i] for i in self.selected]
+
+    def embed_batch(
+        model: Callable[[torch.Tensor], torch.Tensor],
+        imgs: torch.Tensor,
+        device: torch.device,
+    ) -> np.ndarray:
+        """Unit-length embeddings for a batch of preprocessed pages."""
+        with torch.no_grad():
+            feats = model(imgs.to(device)).float()
+        feats = feats.view(feats.size(0), -1)
+        return (feats / feats.norm(dim=1, keepdim=True)).cpu().numpy()
 
     def extract_features(
-        filepaths: list,
-        model: nn.Module,
-        transform: transforms.Compose,
+        pages: list[Tuple[ArchiveBase, str]],
+        model: Callable[[torch.Tensor], torch.Tensor],
+        transform: Callable[[Image.Image], torch.Tensor],
+        short_side: int | None,
         device: torch.device,
         batch_size: int,
         num_workers: int,
         console: Console,
-    ) -> Tuple[list, np.ndarray]:
-        ds = ImageDataset(filepaths, transform)
+    ) -> Iterator[np.ndarray]:
+        """Yield the embeddings of pages batch by batch, in page order."""
+        ds = PageDataset(pages, transform, short_side, batch_size, num_workers)
         loader = DataLoader(
             ds,
             batch_size=batch_size,
@@ -817,10 +3017,17 @@ def create_chapters_command(
             drop_last=False,
             persistent_workers=True,
         )
-        all_feats: list[np.ndarray] = []
-        all_names: list[str] = []
-        model.eval()
-        with torch.no_grad():
+        offset = 0
+        load_seconds = 0.0
+        model_seconds = 0.0
+        # Solid archives are read once, here, and their pages handed to the workers. The
+        # feeder thread only starts once iter() has started the workers.
+        batches = iter(loader)
+        stop = threading.Event()
+        feeder = threading.Thread(target=ds.feed, args=(stop,), daemon=True)
+        if ds.queues:
+            feeder.start()
+        try:
             with Progress(
                 TextColumn("[progress.description]{task.description}"),
                 BarColumn(),
@@ -832,204 +3039,1254 @@ def create_chapters_command(
                 feature_task_id = progress_display.add_task(
                     "Computing similarity", total=len(ds)
                 )
-                for imgs, names_batch in loader:
-                    imgs: torch.Tensor = imgs.to(device)
-                    feats = model(imgs)
-                    feats = feats.view(feats.size(0), -1)
-                    feats = feats / feats.norm(dim=1, keepdim=True)
-                    all_feats.append(feats.cpu())
-                    all_names.extend(names_batch)
-                    progress_display.update(feature_task_id, advance=imgs.size(0))
-        return all_names, torch.cat(all_feats, dim=0).numpy()
+                for imgs, names_batch, page_seconds in batches:
+                    expected = [
+                        name for _, name in pages[offset : offset + len(names_batch)]
+                    ]
+                    if list(names_batch) != expected:
+                        raise RuntimeError("Page batches arrived out of order")
+                    offset += len(names_batch)
+                    load_seconds += float(page_seconds.sum())
+                    start = time.perf_counter()
+                    feats = embed_batch(model, imgs, device)
+                    model_seconds += time.perf_counter() - start
+                    progress_display.update(feature_task_id, advance=len(feats))
+                    yield feats
+        finally:
+            stop.set()
+            if feeder.is_alive():
+                feeder.join()
+            # Pages left queued for workers that have gone would otherwise keep the
+            # queues' own feeder threads, and so this process, from exiting.
+            for worker_queue in ds.queues:
+                worker_queue.cancel_join_thread()
+                worker_queue.close()
+        # Whichever side is slower limits the run: add workers, or pick a faster backend.
+        loader_rate = offset / load_seconds if load_seconds else math.inf
+        model_rate = offset / model_seconds if model_seconds else math.inf
+        bottleneck = "loader" if loader_rate * num_workers < model_rate else "model"
+        console.print(
+            f"Loader: [bold cyan]{loader_rate:.1f}[/bold cyan] pages/s per worker "
+            f"([bold cyan]{loader_rate * num_workers:.1f}[/bold cyan] with {num_workers}) • "
+            f"Model: [bold cyan]{model_rate:.1f}[/bold cyan] pages/s • "
+            f"Bottleneck: [bold yellow]{bottleneck}[/bold yellow]"
+        )
+
+    def stream_chapters(
+        archiver: ArchiveBase,
+        files: list[str],
+        names: list[str],
+        scored: Iterator[Tuple[np.ndarray, np.ndarray]],
+        threshold: float,
+        output_dir: pathlib.Path,
+        workers: int,
+        console: Console,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Consume (best similarity, best target) batches for names, in page order, and hand
+        chapter N to a writer thread as soon as the break starting chapter N + 1 is found.
+        Returns every page's best similarity and best target.
+        """
+        chapters: queue.Queue = queue.Queue()
+        errors: list[BaseException] = []
+
+        def write_chapters() -> None:
+            try:
+                for path in write_chapter_zips(
+                    archiver, iter(chapters.get, None), output_dir, workers
+                ):
+                    console.print(f"Wrote [green]{path.name}[/green]")
+            except BaseException as err:
+                errors.append(err)
+                # Keep draining so the scoring side never blocks on a dead writer.
+                while chapters.get() is not None:
+                    pass
+
+        writer = threading.Thread(target=write_chapters, daemon=True)
+        writer.start()
+        positions = {name: i for i, name in enumerate(files)}
+        chapter_start: int | None = None
+        sims = [np.empty(0, dtype=np.float32)]
+        best_targets = [np.empty(0, dtype=np.intp)]
+        offset = 0
+        try:
+            for batch_sims, batch_targets in scored:
+                sims.append(batch_sims)
+                best_targets.append(batch_targets)
+                batch_names = names[offset : offset + len(batch_sims)]
+                offset += len(batch_sims)
+                for name, sim in zip(batch_names, batch_sims, strict=True):
+                    if sim < threshold:
+                        continue
+                    position = positions[name]
+                    if chapter_start is None:
+                        # The first match doesn't split: pages before it join chapter 1.
+                        chapter_start = 0
+                    else:
+                        chapters.put(files[chapter_start:position])
+                        chapter_start = position
+                if errors:
+                    break
+            if chapter_start is not None and not errors:
+                chapters.put(files[chapter_start:])
+        finally:
+            chapters.put(None)
+            writer.join()
+        if errors:
+            raise errors[0]
+        return np.concatenate(sims), np.concatenate(best_targets)
 
     console = Console()
 
-    # Determine and create output directory
-    if output_dir is None:
-        if input_dir == ".":
-            # If input is current directory, default output to a 'chapters' subdir in current dir
-            final_output_dir = os.path.join(os.getcwd(), "chapters")
+    if backend not in INFERENCE_BACKENDS:
+        console.print(
+            f"[bold red]Error: Unknown backend {backend}. Choices: {list(INFERENCE_BACKENDS)}[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    if prefilter is not None and prefilter not in PERCEPTUAL_HASHES:
+        console.print(
+            f"[bold red]Error: Unknown prefilter {prefilter}. Choices: {list(PERCEPTUAL_HASHES)}[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    if stream and plot:
+        console.print(
+            "[bold red]Error: --plot needs every score before it can draw; drop --stream[/bold red]"
+        )
+        raise typer.Exit(code=1)
+
+    inputs = [input_dir, *(extra_volumes or [])]
+    volumes: list[Volume] = []
+    for volume_input in inputs:
+        archiver = archiver_factory(pathlib.Path(volume_input))
+        if archiver is None:
+            console.print(
+                f"[bold red]Error: {volume_input} is not a directory or a supported archive[/bold red]"
+            )
+            raise typer.Exit(code=1)
+
+        # Determine output directory
+        if output_dir is None:
+            if volume_input == ".":
+                # If input is current directory, default output to a 'chapters' subdir in current dir
+                final_output_dir = os.path.join(os.getcwd(), "chapters")
+            elif archiver.path.is_file():
+                # Default output to a directory named after the archive, next to it
+                final_output_dir = str(archiver.path.with_suffix(""))
+            else:
+                # Default output to 'chapters' subdirectory within the input directory
+                final_output_dir = os.path.join(volume_input, "chapters")
+        elif len(inputs) > 1:
+            # One subdirectory per volume, named after it
+            volume_path = archiver.path.resolve()
+            if volume_path.is_file():
+                volume_path = volume_path.with_suffix("")
+            final_output_dir = os.path.join(output_dir, volume_path.name)
         else:
-            # Default output to 'chapters' subdirectory within input_dir
-            final_output_dir = os.path.join(input_dir, "chapters")
-    else:
-        final_output_dir: str = output_dir
+            final_output_dir = output_dir
+        files = archiver.page_names()
+        if not files:
+            console.print(
+                f"[bold red]Error: No pages found in {volume_input}[/bold red]"
+            )
+            raise typer.Exit(code=1)
+        volumes.append(
+            Volume(
+                archiver,
+                pathlib.Path(final_output_dir),
+                files,
+                list(range(len(files))),
+            )
+        )
 
-    os.makedirs(final_output_dir, exist_ok=True)
-    console.print(
-        f"Output directory: [bold green]{os.path.abspath(final_output_dir)}[/bold green]"
-    )
+    output_dirs = [volume.output_dir.resolve() for volume in volumes]
+    if len(set(output_dirs)) < len(output_dirs):
+        console.print(
+            "[bold red]Error: Several volumes would write to the same output directory; give them distinct names[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    for volume in volumes:
+        volume.output_dir.mkdir(parents=True, exist_ok=True)
+        console.print(
+            f"Output directory: [bold green]{os.path.abspath(volume.output_dir)}[/bold green]"
+        )
 
-    # Check targets
-    target_paths: list[str] = []
+    # Check targets; each is taken from the first volume with a page of that name.
+    targets: list[Tuple[Volume, int]] = []
     for target_image_name in chapter_break_images:
-        target_path = os.path.join(input_dir, target_image_name)
-        if not os.path.isfile(target_path):
+        for volume in volumes:
+            if target_image_name in volume.files:
+                targets.append((volume, volume.files.index(target_image_name)))
+                break
+        else:
+            where = (
+                os.path.join(input_dir, target_image_name)
+                if len(volumes) == 1
+                else f"{target_image_name} (in none of the {len(volumes)} volumes)"
+            )
             console.print(
-                f"[bold red]Error: Target image not found: {target_path}[/bold red]"
+                f"[bold red]Error: Target image not found: {where}[/bold red]"
             )
             raise typer.Exit(code=1)
-        target_paths.append(target_path)
 
     console.print(
         f"Using [bold cyan]{len(chapter_break_images)}[/bold cyan] chapter break images: [cyan]{', '.join(chapter_break_images)}[/cyan]"
     )
 
-    # Gather files
-    files = sorted(
-        [f for f in os.listdir(input_dir) if f.lower().endswith(tuple(IMG_EXTENSIONS))],
-        key=alphanum_key,
+    preprocess = embedding_transform()
+    # Pages are decoded only as large as the preprocessing needs, unless asked otherwise.
+    short_side = None if full_decode else EMBEDDING_RESIZE
+
+    # Pages to embed: all of them, or the prefilter's candidates plus a random audit
+    # sample of the pages it rejected.
+    if prefilter is not None:
+        with console.status(f"Computing {prefilter} hashes..."):
+            hashes = []
+            for volume in volumes:
+                thumbnails = map_members(
+                    volume.archiver,
+                    volume.files,
+                    functools.partial(load_hash_thumbnail, method=prefilter),
+                    num_workers,
+                )
+                hashes.append(perceptual_hashes(np.stack(list(thumbnails)), prefilter))
+        target_hashes = np.array(
+            [hashes[volumes.index(volume)][index] for volume, index in targets],
+            dtype=np.uint64,
+        )
+        kept = 0
+        audited = 0
+        for volume, volume_hashes in zip(volumes, hashes, strict=True):
+            distances = hamming_distances(volume_hashes, target_hashes).min(axis=1)
+            candidates = set(np.flatnonzero(distances <= prefilter_distance).tolist())
+            candidates.update(index for owner, index in targets if owner is volume)
+            rejected = [i for i in range(len(volume.files)) if i not in candidates]
+            volume.rejected_count = len(rejected)
+            if rejected:
+                rng = np.random.default_rng(0)
+                sample_size = min(prefilter_audit, len(rejected))
+                volume.audit = rng.choice(
+                    rejected, size=sample_size, replace=False
+                ).tolist()
+            volume.selected = sorted(candidates.union(volume.audit))
+            kept += len(candidates)
+            audited += len(volume.audit)
+        console.print(
+            f"Prefilter kept [bold cyan]{kept}[/bold cyan] of [bold cyan]{sum(len(volume.files) for volume in volumes)}[/bold cyan] pages within distance [yellow]{prefilter_distance}[/yellow] (auditing {audited} rejected)"
+        )
+    volume_names = [volume.names for volume in volumes]
+
+    @functools.cache
+    def load_runner() -> Tuple[Callable[[torch.Tensor], torch.Tensor], torch.device]:
+        # Loaded once, however many volumes are processed.
+        model = load_embedding_model()
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        if backend in CPU_ONLY_BACKENDS:
+            device = torch.device("cpu")
+        if backend == "eager" and torch.cuda.device_count() > 1:
+            model = nn.DataParallel(model)
+        model.to(device)
+        console.print(
+            f"Using device [bold green]{device}[/bold green] with the [bold green]{backend}[/bold green] backend"
+        )
+        samples = []
+        if backend != "eager":
+            # A few real pages to trace or calibrate the backend with.
+            sample_volume = targets[0][0]
+            samples = [
+                batch.to(device)
+                for batch in load_page_batches(
+                    sample_volume.archiver,
+                    sample_volume.names,
+                    preprocess,
+                    batch_size,
+                    4,
+                    short_side,
+                )
+            ]
+        try:
+            return INFERENCE_BACKENDS[backend](model, samples), device
+        except (ImportError, RuntimeError) as e:
+            console.print(f"[bold red]Error: {e}[/bold red]")
+            raise typer.Exit(code=1) from e
+
+    def embed(pages: list[Tuple[ArchiveBase, str]]) -> Iterator[np.ndarray]:
+        """Batch feature extraction, yielding embeddings in page order."""
+        runner, device = load_runner()
+        yield from extract_features(
+            pages,
+            runner,
+            preprocess,
+            short_side,
+            device,
+            batch_size,
+            num_workers,
+            console,
+        )
+
+    target_pages = [(volume.archiver, volume.files[index]) for volume, index in targets]
+    if use_cache:
+        # Embeddings only depend on page content, the model, the preprocessing and
+        # (slightly) the decode path and backend.
+        cache_config = {
+            "model": embedding_model_id(),
+            "preprocess": repr(preprocess),
+            "decode": "full" if short_side is None else f"reduced:{short_side}",
+        }
+        if backend != "eager":
+            cache_config["backend"] = backend
+        cache = EmbeddingCache(
+            pathlib.Path(cache_dir)
+            if cache_dir
+            else default_cache_dir() / "embeddings",
+            cache_config,
+        )
+        with console.status("Hashing pages..."):
+            for volume, names in zip(volumes, volume_names, strict=True):
+                volume.digests = list(
+                    map_members(volume.archiver, names, content_digest, num_workers)
+                )
+
+        target_digests = [
+            volume.digests[volume.selected.index(index)] for volume, index in targets
+        ]
+        # One stream of batches for the pages of every volume that aren't cached yet.
+        # Targets lead it, so every later batch can be scored as soon as it arrives.
+        missing: dict[str, Tuple[ArchiveBase, str]] = {}
+        for digest, page in zip(target_digests, target_pages, strict=True):
+            if digest not in cache:
+                missing.setdefault(digest, page)
+        for volume, names in zip(volumes, volume_names, strict=True):
+            for digest, name in zip(volume.digests, names, strict=True):
+                if digest not in cache:
+                    missing.setdefault(digest, (volume.archiver, name))
+        total_pages = sum(len(names) for names in volume_names)
+        console.print(
+            f"Reusing [bold cyan]{total_pages - len(missing)}[/bold cyan] cached embeddings, computing [bold cyan]{len(missing)}[/bold cyan]"
+        )
+        batches = embed(list(missing.values())) if missing else iter(())
+        pending = iter(missing)
+        computed: dict[str, np.ndarray] = {}
+
+        def embeddings_for(digests: list[str]) -> np.ndarray:
+            """
+            Cached embeddings (read from the float16 store) merged in order with freshly
+            computed ones, taking batches from the stream until each digest is covered.
+            """
+            for digest in digests:
+                while digest not in cache and digest not in computed:
+                    batch = next(batches)
+                    # Round like the cache does, so reruns score pages identically.
+                    batch = batch.astype(EmbeddingCache.DTYPE).astype(np.float32)
+                    computed.update(
+                        zip(itertools.islice(pending, len(batch)), batch, strict=True)
+                    )
+            cached = iter(cache.get(d for d in digests if d not in computed))
+            return np.stack(
+                [computed[d] if d in computed else next(cached) for d in digests]
+            )
+
+        target_feats = embeddings_for(target_digests)
+
+        def page_embeddings(volume: Volume) -> Iterator[np.ndarray]:
+            """A volume's embeddings, writing new ones to the cache as they accumulate."""
+            for start in range(0, len(volume.digests), batch_size):
+                yield embeddings_for(volume.digests[start : start + batch_size])
+                if len(computed) >= EmbeddingCache.FLUSH_ROWS:
+                    cache.add(list(computed), np.stack(list(computed.values())))
+                    computed.clear()
+            if computed:
+                cache.add(list(computed), np.stack(list(computed.values())))
+                computed.clear()
+    else:
+        # One stream of batches for the pages of every volume, split back up per volume.
+        # Targets lead it, so every later batch can be scored as soon as it arrives.
+        batches = embed(
+            target_pages
+            + [
+                (volume.archiver, name)
+                for volume, names in zip(volumes, volume_names, strict=True)
+                for name in names
+            ]
+        )
+        rows = itertools.chain.from_iterable(batches)
+        target_feats = np.stack(list(itertools.islice(rows, len(target_pages))))
+
+        def page_embeddings(volume: Volume) -> Iterator[np.ndarray]:
+            volume_rows = itertools.islice(rows, len(volume.selected))
+            while chunk := list(itertools.islice(volume_rows, batch_size)):
+                yield np.stack(chunk)
+
+    def scored_batches(volume: Volume) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Each page's best similarity across all targets and which target it was, batch by
+        batch, so only those two numbers per page are ever kept.
+        """
+        for feats in page_embeddings(volume):
+            best_sims, best_targets = top_k_similarities(feats, target_feats)
+            yield best_sims[:, 0], best_targets[:, 0]
+
+    results: list[Tuple[np.ndarray, np.ndarray]] = []
+    for volume, names in zip(volumes, volume_names, strict=True):
+        if stream:
+            results.append(
+                stream_chapters(
+                    volume.archiver,
+                    volume.files,
+                    names,
+                    scored_batches(volume),
+                    threshold,
+                    volume.output_dir,
+                    num_workers,
+                    console,
+                )
+            )
+        else:
+            scored = list(scored_batches(volume))
+            results.append(
+                (
+                    np.concatenate(
+                        [np.empty(0, dtype=np.float32)] + [s for s, _ in scored]
+                    ),
+                    np.concatenate(
+                        [np.empty(0, dtype=np.intp)] + [t for _, t in scored]
+                    ),
+                )
+            )
+    # Let the batch stream finish, closing its progress display.
+    for _ in batches:
+        pass
+
+    for volume, (max_sims, best_target_idx) in zip(volumes, results, strict=True):
+        if len(volumes) > 1:
+            console.print(f"\n[bold]{volume.archiver.path}[/bold]")
+        is_match = max_sims >= threshold
+
+        if prefilter is not None:
+            # Matches among audited pages are ones the prefilter alone would have dropped.
+            is_audit = np.isin(volume.selected, volume.audit)
+            found = int(np.sum(is_match & ~is_audit))
+            missed = int(np.sum(is_match & is_audit))
+            estimated_missed = (
+                missed * volume.rejected_count / len(volume.audit)
+                if volume.audit
+                else 0.0
+            )
+            recall = (
+                found / (found + estimated_missed) if found + estimated_missed else 1.0
+            )
+            console.print(
+                f"Prefilter recall: [bold magenta]{recall:.1%}[/bold magenta] (estimated; {missed} of {len(volume.audit)} audited rejected pages matched)"
+            )
+
+        # Find matches
+        indices = [volume.selected[i] for i in np.flatnonzero(is_match)]
+        console.print(
+            f"Found [bold magenta]{len(indices)}[/bold magenta] matches for threshold [yellow]{threshold}[/yellow]"
+        )
+
+        # Show breakdown by target
+        target_counts = np.bincount(
+            best_target_idx[is_match], minlength=len(chapter_break_images)
+        )
+
+        table = Table(
+            title="[bold]Matches per Target Image[/bold]",
+            title_style="none",
+            show_header=True,
+            header_style="bold blue",
+        )
+        table.add_column("Target Image", style="cyan", no_wrap=True)
+        table.add_column("Matches", justify="right", style="magenta")
+        for target_idx in np.argsort(-target_counts, kind="stable"):
+            if target_counts[target_idx]:
+                table.add_row(
+                    chapter_break_images[target_idx], str(target_counts[target_idx])
+                )
+        console.print(table)
+
+        if plot:
+            if not len(max_sims):
+                continue
+            # Plotting similarity values
+            console.print("\n[bold]Plotting Similarity Values[/bold]")
+            plt.clf()
+            plt.title("Max Similarity Score Distribution")
+            plt.xlabel("Cosine Similarity")
+            plt.ylabel("Frequency")
+
+            # Use the same bins for all data
+            bins = np.linspace(max_sims.min(), max_sims.max(), 30)
+
+            # Prepare data for a stacked bar chart
+            bar_labels = [f"{b:.2f}" for b in (bins[:-1] + bins[1:]) / 2]
+            bar_data = []
+            legend_labels = []
+
+            for target_idx, target_name in enumerate(chapter_break_images):
+                # Histogram of the pages where this target was the best match
+                counts, _ = np.histogram(
+                    max_sims[best_target_idx == target_idx], bins=bins
+                )
+                bar_data.append(list(counts))
+                legend_labels.append(target_name)
+
+            plt.stacked_bar(bar_labels, bar_data, labels=legend_labels)
+
+            plt.show()
+            continue
+
+        if len(indices) < 1:
+            console.print("[yellow]No matches found; nothing to split.[/yellow]")
+            continue
+
+        if stream:
+            console.print(
+                f"[bold green]Successfully created {len(indices)} chapters.[/bold green]"
+            )
+            continue
+
+        # Split chapters
+        split_points = indices[1:]
+        chapters = []
+        prev = 0
+        for pt in split_points:
+            chapters.append(volume.files[prev:pt])
+            prev = pt
+        chapters.append(volume.files[prev:])
+
+        # Write CBZs straight from the source's member bytes
+        with Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            MofNCompleteColumn(),
+            TimeRemainingColumn(),
+            console=console,
+        ) as progress_display:
+            cbz_task_id = progress_display.add_task(
+                "Creating CBZ files", total=len(chapters)
+            )
+            for _ in write_chapter_zips(
+                volume.archiver, chapters, volume.output_dir, num_workers
+            ):
+                progress_display.update(cbz_task_id, advance=1)
+
+        console.print(
+            f"[bold green]Successfully created {len(chapters)} chapters.[/bold green]"
+        )
+
+
+# ----- BENCH SUBCOMMANDS -----
+bench_app = typer.Typer(help="Benchmarks for archive readers and image transforms.")
+app.add_typer(bench_app, name="bench")
+
+
+def _peak_rss_bytes() -> int:
+    """Peak resident set size of the current process in bytes."""
+    # ru_maxrss survives fork/exec on Linux, so prefer the per-process high-water mark.
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _generate_page(index: int, width: int, height: int, codec: str = "jpeg") -> bytes:
+    """Render a synthetic page with scan-like texture so that it compresses realistically."""
+    noise = Image.effect_noise((max(1, width // 4), max(1, height // 4)), 48)
+    noise = noise.resize((width, height), Image.Resampling.BILINEAR)
+    img = Image.merge(
+        "RGB",
+        (noise, noise.point(lambda v: (v + 7 * index) % 256), noise),
     )
-    paths = [os.path.join(input_dir, f) for f in files]
+    buf = io.BytesIO()
+    img.save(buf, format=codec, quality=85)
+    return buf.getvalue()
 
-    preprocess = transforms.Compose(
-        [
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+
+def _run_isolated(func: Callable[..., int], *args) -> Tuple[float, int, int]:
+    """
+    Run func(*args) in a fresh process and return (seconds, bytes processed, peak RSS),
+    so that peak memory isn't polluted by earlier runs.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_timed_call, func, *args).result()
+
+
+def _timed_call(func: Callable[..., int], *args) -> Tuple[float, int, int]:
+    start = time.perf_counter()
+    nbytes = func(*args)
+    return time.perf_counter() - start, nbytes, _peak_rss_bytes()
+
+
+def _noop(*_args) -> int:
+    return 0
+
+
+def _read_cb7_readall(path: pathlib.Path) -> int:
+    """The pre-streaming approach: decompress every member into memory at once."""
+    factory = BytesIOFactory(limit=1 << 40)
+    with py7zr.SevenZipFile(path, mode="r") as sz:
+        sz.extract(factory=factory)
+    for product in factory.products.values():
+        product.seek(0)
+        with Image.open(io.BytesIO(product.read())) as img:
+            img.load()
+    return sum(product.size() for product in factory.products.values())
+
+
+def _read_cb7_stream(path: pathlib.Path, budget: int) -> int:
+    # Decode every page, so the producer runs ahead while the consumer is busy as it
+    # does in clamp.
+    archiver = ArchiveCB7(path, memory_budget=budget)
+    nbytes = 0
+    for _, fp in archiver.iter_members():
+        data = fp.read()
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+        nbytes += len(data)
+    return nbytes
+
+
+@bench_app.command("cb7")
+def bench_cb7(
+    pages: Annotated[
+        int, typer.Option("-n", "--pages", min=1, help="Pages per generated archive.")
+    ] = 100,
+    width: Annotated[int, typer.Option(help="Page width in pixels.")] = 1600,
+    height: Annotated[int, typer.Option(help="Page height in pixels.")] = 2400,
+    budget: Annotated[
+        int,
+        typer.Option(
+            "-b", "--budget", help="Memory budget (in MiB) for the streaming reader."
+        ),
+    ] = CB7_MEMORY_BUDGET // (1024 * 1024),
+    repeat: Annotated[
+        int, typer.Option("-r", "--repeat", min=1, help="Runs per reader.")
+    ] = 3,
+):
+    """
+    Compare throughput and peak RSS of the streaming CB7 reader against readall().
+    """
+    from rich.table import Table
+
+    console = Console()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        archive = pathlib.Path(temp_dir) / "bench.cb7"
+        with console.status(f"Generating {pages} page cb7 archive..."):
+            # A low preset keeps generation quick; it's still a single solid block.
+            filters = [{"id": py7zr.FILTER_LZMA2, "preset": 1}]
+            with py7zr.SevenZipFile(archive, mode="w", filters=filters) as sz:
+                for i in range(pages):
+                    sz.writestr(_generate_page(i, width, height), f"{i:04}.jpg")
+        console.print(
+            f"Archive: {pages} pages, {archive.stat().st_size / 2**20:.1f} MiB compressed"
+        )
+
+        readers: list[Tuple[str, Callable[..., int], tuple]] = [
+            ("baseline (interpreter)", _noop, (archive,)),
+            ("readall", _read_cb7_readall, (archive,)),
+            (f"stream ({budget} MiB)", _read_cb7_stream, (archive, budget * 2**20)),
         ]
+        table = Table(title="CB7 reader benchmark", header_style="bold blue")
+        table.add_column("Reader", style="cyan")
+        table.add_column("Best time (s)", justify="right")
+        table.add_column("MiB/s", justify="right")
+        table.add_column("Peak RSS (MiB)", justify="right", style="magenta")
+        for label, func, args in readers:
+            runs = [_run_isolated(func, *args) for _ in range(repeat)]
+            seconds = min(run[0] for run in runs)
+            nbytes = runs[0][1]
+            peak = max(run[2] for run in runs)
+            throughput = f"{nbytes / seconds / 2**20:.1f}" if nbytes else "-"
+            table.add_row(label, f"{seconds:.3f}", throughput, f"{peak / 2**20:.1f}")
+        console.print(table)
+
+
+def _send_progress_messages(count: int, queue=None) -> None:
+    """Emit `count` page_done messages plus a closing chapter_done, like a clamp worker."""
+    progress = queue if queue is not None else _worker_progress_channel()
+    for num in range(count):
+        progress.put(
+            {
+                "type": "page_done",
+                "chapter_name": "bench",
+                "page_name": f"{num:04}.jpg",
+                "total_pages": count,
+            }
+        )
+    progress.put(
+        {"type": "chapter_done", "chapter_name": "bench", "total_images": count}
     )
 
-    backbone = models.efficientnet_b0(
-        weights=efficientnet.EfficientNet_B0_Weights.DEFAULT
+
+@bench_app.command("progress")
+def bench_progress(
+    messages: Annotated[
+        int,
+        typer.Option("-n", "--messages", min=1, help="Progress messages to send."),
+    ] = 20_000,
+):
+    """
+    Compare per-message overhead of a Manager().Queue() against the batched ProgressChannel.
+    """
+    from rich.table import Table
+
+    console = Console()
+    table = Table(title="Progress channel benchmark", header_style="bold blue")
+    table.add_column("Channel", style="cyan")
+    table.add_column("Total (s)", justify="right")
+    table.add_column("Per message (µs)", justify="right", style="magenta")
+
+    with Manager() as manager:
+        queue = manager.Queue()
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            executor.submit(_noop).result()  # Exclude worker startup.
+            start = time.perf_counter()
+            future = executor.submit(_send_progress_messages, messages, queue)
+            while queue.get()["type"] != "chapter_done":
+                pass
+            future.result()
+            elapsed = time.perf_counter() - start
+    table.add_row(
+        "Manager().Queue()", f"{elapsed:.3f}", f"{elapsed / messages * 1e6:.1f}"
     )
-    model = nn.Sequential(
-        backbone.features,
-        nn.AdaptiveAvgPool2d(1),
-        nn.Flatten(),
+
+    with ProgressChannel() as channel:
+        with ProcessPoolExecutor(
+            max_workers=1, initializer=_init_pool_worker, initargs=(channel,)
+        ) as executor:
+            executor.submit(_noop).result()
+            start = time.perf_counter()
+            future = executor.submit(_send_progress_messages, messages)
+            done = False
+            while not done:
+                done = any(m["type"] == "chapter_done" for m in channel.get())
+            future.result()
+            elapsed = time.perf_counter() - start
+    table.add_row(
+        "ProgressChannel", f"{elapsed:.3f}", f"{elapsed / messages * 1e6:.1f}"
     )
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    if torch.cuda.device_count() > 1:
-        model = nn.DataParallel(model)
-    model.to(device)
-    console.print(f"Using device [bold green]{device}[/bold green]")
-
-    # Batch feature extraction
-    names, feats = extract_features(
-        paths, model, preprocess, device, batch_size, num_workers, console
+    console.print(table)
+
+
+@bench_app.command("encoders")
+def bench_encoders(
+    chapter: Annotated[
+        pathlib.Path,
+        typer.Argument(exists=True, help="Sample chapter (archive or directory)."),
+    ],
+    presets: Annotated[
+        list[str] | None,
+        typer.Option(
+            "-e",
+            "--encoder",
+            help="Encoder preset to benchmark; repeat for several. Defaults to all.",
+            autocompletion=lambda: list(ENCODERS),
+        ),
+    ] = None,
+    pages: Annotated[
+        int, typer.Option("-n", "--pages", min=1, help="Maximum pages to encode.")
+    ] = 20,
+):
+    """
+    Report pages/sec and bytes/page of each clamp encoder preset on a sample chapter.
+    """
+    from rich.table import Table
+
+    console = Console()
+    archiver = archiver_factory(chapter)
+    if archiver is None:
+        console.print(f"[red]Unsupported file type for {chapter.name}[/red]")
+        raise typer.Exit(code=1)
+    unknown = [name for name in presets or [] if name not in ENCODERS]
+    if unknown:
+        console.print(f"[red]Unknown encoder presets: {', '.join(unknown)}[/red]")
+        raise typer.Exit(code=1)
+
+    # Decode once up front so that only encoding is timed.
+    page_names = archiver.page_names()[:pages]
+    images = [img.copy() for _, img in archiver.iter_pages(page_names)]
+    if not images:
+        console.print("[blue]No pages found.[/blue]")
+        return
+
+    results: list[Tuple[str, float, float]] = []
+    for name in presets or list(ENCODERS):
+        encoder = ENCODERS[name]
+        total_bytes = 0
+        start = time.perf_counter()
+        for image in images:
+            buf = io.BytesIO()
+            encoder.save(image, buf)
+            total_bytes += buf.tell()
+        elapsed = time.perf_counter() - start
+        results.append((name, len(images) / elapsed, total_bytes / len(images)))
+
+    # Sizes are reported relative to the default preset when it was benchmarked.
+    reference_name, _, reference_size = next(
+        (result for result in results if result[0] == "webp"), results[0]
     )
+    table = Table(
+        title=f"Encoder benchmark ({len(images)} pages of {chapter.name})",
+        header_style="bold blue",
+    )
+    table.add_column("Preset", style="cyan")
+    table.add_column("Pages/s", justify="right")
+    table.add_column("KiB/page", justify="right", style="magenta")
+    table.add_column(f"Size vs {reference_name}", justify="right")
+    for name, pages_per_second, bytes_per_page in results:
+        table.add_row(
+            name,
+            f"{pages_per_second:.1f}",
+            f"{bytes_per_page / 1024:.1f}",
+            f"{bytes_per_page / reference_size:.2f}x",
+        )
+    console.print(table)
 
-    # Extract target features
-    target_feats = []
-    for target_image in chapter_break_images:
-        target_idx = names.index(target_image)
-        target_feats.append(feats[target_idx])
 
-    target_feats = np.array(target_feats)  # Shape: (num_targets, feature_dim)
+def _generate_archives(
+    root: pathlib.Path, pages: int, width: int, height: int, codec: str
+) -> dict[str, pathlib.Path]:
+    """
+    Write the same synthetic chapter once per registered archive format. Formats whose
+    writer isn't available here (e.g. cbr without the rar tool) are skipped.
+    """
+    extension = {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}[codec]
+    members = [
+        (f"{i:04}{extension}", _generate_page(i, width, height, codec))
+        for i in range(pages)
+    ]
+    archives: dict[str, pathlib.Path] = {}
+    for suffix, archiver_cls in ARCHIVERS.items():
+        # The comic suffix of each format, plus plain directories.
+        if suffix != "/" and not suffix.startswith(".cb"):
+            continue
+        label = "dir" if suffix == "/" else suffix.lstrip(".")
+        dest = root / ("chapter_dir" if suffix == "/" else f"chapter{suffix}")
+        try:
+            with archiver_cls.open_writer(dest) as add:
+                for name, data in members:
+                    add(name, io.BytesIO(data))
+        except (RuntimeError, OSError, subprocess.CalledProcessError):
+            continue
+        archives[label] = dest
+    return archives
+
+
+def _best_time(func: Callable[[], object], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@bench_app.command("suite")
+def bench_suite(
+    pages: Annotated[
+        int, typer.Option("-n", "--pages", min=1, help="Pages per generated archive.")
+    ] = 20,
+    width: Annotated[int, typer.Option(help="Page width in pixels.")] = 1600,
+    height: Annotated[int, typer.Option(help="Page height in pixels.")] = 2400,
+    codec: Annotated[
+        str,
+        typer.Option(
+            help="Codec of the generated pages: jpeg, png or webp.",
+            autocompletion=lambda: ["jpeg", "png", "webp"],
+        ),
+    ] = "jpeg",
+    encoder_name: Annotated[
+        str,
+        typer.Option(
+            "-e",
+            "--encoder",
+            help="Encoder preset timed for the encode step.",
+            autocompletion=lambda: list(ENCODERS),
+        ),
+    ] = "webp",
+    repeat: Annotated[
+        int, typer.Option("-r", "--repeat", min=1, help="Runs per measurement.")
+    ] = 3,
+    output: Annotated[
+        pathlib.Path | None,
+        typer.Option("-o", "--output", help="Write results to this JSON file."),
+    ] = None,
+    compare: Annotated[
+        pathlib.Path | None,
+        typer.Option(
+            "-c",
+            "--compare",
+            exists=True,
+            dir_okay=False,
+            help="Earlier results JSON to compare against.",
+        ),
+    ] = None,
+    tolerance: Annotated[
+        float,
+        typer.Option(
+            help="Slowdown (as a fraction) beyond which a comparison counts as a regression."
+        ),
+    ] = 0.10,
+):
+    """
+    Time archive operations for every registered format and each image transform on
+    generated chapters. Exits non-zero if --compare finds a regression.
+    """
+    from rich.table import Table
 
-    # Compute similarities against all targets and take the maximum
-    all_sims = feats @ target_feats.T  # Shape: (num_images, num_targets)
-    max_sims = np.max(all_sims, axis=1)  # Take max similarity across all targets
+    console = Console()
+    codec = codec.lower()
+    if codec not in ("jpeg", "png", "webp") or encoder_name not in ENCODERS:
+        console.print("[red]Unsupported --codec or --encoder.[/red]")
+        raise typer.Exit(code=1)
+    encoder = ENCODERS[encoder_name]
+    size_threshold = width * height // 2
+
+    results: dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = pathlib.Path(temp_dir)
+        with console.status("Generating archives..."):
+            archives = _generate_archives(root, pages, width, height, codec)
+        console.print(f"Formats: [cyan]{', '.join(archives)}[/cyan]")
+
+        for label, path in archives.items():
+            archiver = archiver_factory(path)
+            assert archiver is not None
+            with console.status(f"Timing {label}..."):
+                results[f"{label}.get_images"] = _best_time(archiver.get_images, repeat)
+
+                extract_dir = root / f"extract_{label}"
+
+                def extract(archiver=archiver, extract_dir=extract_dir) -> None:
+                    shutil.rmtree(extract_dir, ignore_errors=True)
+                    archiver.extract(extract_dir)
+
+                results[f"{label}.extract"] = _best_time(extract, repeat)
+
+                compress_dest = root / f"compressed_{label}{path.suffix}"
+
+                def compress(
+                    archiver=archiver, extract_dir=extract_dir, dest=compress_dest
+                ) -> None:
+                    if dest.is_dir():
+                        shutil.rmtree(dest)
+                    elif dest.exists():
+                        dest.unlink()
+                    archiver.compress(extract_dir, dest)
+
+                results[f"{label}.compress"] = _best_time(compress, repeat)
+
+        # Image transforms don't depend on the container, so time them once.
+        sample = archiver_factory(next(iter(archives.values())))
+        assert sample is not None
+        images = sample.get_images()
+        with console.status("Timing image transforms..."):
+            results["transform.split_images"] = _best_time(
+                lambda: list(split_images(images, size_threshold)), repeat
+            )
+            results["transform.split_images_at_gutters"] = _best_time(
+                lambda: list(split_images_at_gutters(images, size_threshold)), repeat
+            )
+            results["transform.resize_images"] = _best_time(
+                lambda: resize_images(images, size_threshold), repeat
+            )
+            results["transform.resize_images_by_width"] = _best_time(
+                lambda: resize_images_by_width(images, width // 2), repeat
+            )
 
-    # Find which target each image is most similar to
-    best_target_idx = np.argmax(all_sims, axis=1)
-    best_target_names = [chapter_break_images[idx] for idx in best_target_idx]
+            def encode() -> None:
+                for image in images:
+                    encoder.save(image, io.BytesIO())
+
+            results[f"encode.{encoder_name}"] = _best_time(encode, repeat)
+
+    report = {
+        "meta": {
+            "pages": pages,
+            "width": width,
+            "height": height,
+            "codec": codec,
+            "encoder": encoder_name,
+            "repeat": repeat,
+            "python": sys.version.split()[0],
+            "pillow": Image.__version__,
+            "platform": sys.platform,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+    if output is not None:
+        output.write_text(json.dumps(report, indent=2))
+        console.print(f"Results written to [bold green]{output}[/bold green]")
+
+    baseline: dict[str, float] = {}
+    if compare is not None:
+        baseline = json.loads(compare.read_text()).get("results", {})
+
+    table = Table(title="comic_book benchmark suite", header_style="bold blue")
+    table.add_column("Measurement", style="cyan")
+    table.add_column("Best (ms)", justify="right")
+    table.add_column("ms/page", justify="right")
+    if baseline:
+        table.add_column("Baseline (ms)", justify="right")
+        table.add_column("Change", justify="right")
+    regressions = []
+    for key, seconds in results.items():
+        row = [key, f"{seconds * 1000:.1f}", f"{seconds * 1000 / pages:.2f}"]
+        if baseline:
+            if key in baseline and baseline[key] > 0:
+                change = seconds / baseline[key] - 1
+                style = "green" if change <= 0 else "yellow"
+                if change > tolerance:
+                    style = "red"
+                    regressions.append(key)
+                row += [
+                    f"{baseline[key] * 1000:.1f}",
+                    f"[{style}]{change:+.1%}[/{style}]",
+                ]
+            else:
+                row += ["-", "-"]
+        table.add_row(*row)
+    console.print(table)
 
-    labels = ["similar" if s >= threshold else "not similar" for s in max_sims]
+    if regressions:
+        console.print(
+            f"[red]{len(regressions)} measurement(s) regressed by more than {tolerance:.0%}: {', '.join(regressions)}[/red]"
+        )
+        raise typer.Exit(code=1)
 
-    # Build DataFrame
-    df = pd.DataFrame(
-        {
-            "filename": names,
-            "cosine_similarity": max_sims,
-            "best_match_target": best_target_names,
-            "label": labels,
-        }
-    )
-    df.sort_values("cosine_similarity", ascending=False, inplace=True)
 
-    # Find matches
-    intro_set = set(df[df["label"] == "similar"]["filename"])
-    indices = [i for i, f in enumerate(files) if f in intro_set]
-    console.print(
-        f"Found [bold magenta]{len(indices)}[/bold magenta] matches for threshold [yellow]{threshold}[/yellow]"
-    )
+def _psnr(reference: Image.Image, image: Image.Image) -> float:
+    """Peak signal-to-noise ratio in dB between two same-sized images (inf if identical)."""
+    import numpy as np
+
+    ref = np.asarray(reference.convert("RGB"), dtype=np.float64)
+    img = np.asarray(image.convert("RGB"), dtype=np.float64)
+    mse = float(np.mean((ref - img) ** 2))
+    return math.inf if mse == 0 else 10 * math.log10(255**2 / mse)
+
+
+@bench_app.command("resize")
+def bench_resize(
+    chapter: Annotated[
+        pathlib.Path | None,
+        typer.Argument(
+            exists=True,
+            help="Sample chapter (archive or directory). Defaults to generated JPEG pages.",
+        ),
+    ] = None,
+    pages: Annotated[
+        int, typer.Option("-n", "--pages", min=1, help="Maximum pages to resize.")
+    ] = 8,
+    width: Annotated[int, typer.Option(help="Generated page width in pixels.")] = 6000,
+    height: Annotated[
+        int, typer.Option(help="Generated page height in pixels.")
+    ] = 9000,
+    target_width: Annotated[
+        int, typer.Option("-t", "--target-width", help="Width to downscale to.")
+    ] = 1600,
+    gaps: Annotated[
+        list[float] | None,
+        typer.Option(
+            "-g",
+            "--reducing-gap",
+            min=1.0,
+            help="Reducing gap to compare against the exact path; repeat for several.",
+        ),
+    ] = None,
+):
+    """
+    Compare throughput and output similarity (PSNR) of the fast downscale path against
+    the exact LANCZOS path. Decoding is included in the timings.
+    """
+    from rich.table import Table
 
-    # Show breakdown by target
-    similar_df = df[df["label"] == "similar"]
-    target_counts = similar_df["best_match_target"].value_counts()
+    console = Console()
+    if chapter is not None:
+        archiver = archiver_factory(chapter)
+        if archiver is None:
+            console.print(f"[red]Unsupported file type for {chapter.name}[/red]")
+            raise typer.Exit(code=1)
+        sources = [
+            fp.read() for _, fp in archiver.iter_members(archiver.page_names()[:pages])
+        ]
+    else:
+        with console.status("Generating pages..."):
+            sources = [_generate_page(i, width, height) for i in range(pages)]
+    if not sources:
+        console.print("[blue]No pages found.[/blue]")
+        return
+
+    def run(reducing_gap: float | None) -> Tuple[float, list[Image.Image]]:
+        start = time.perf_counter()
+        outputs = []
+        for data in sources:
+            with Image.open(io.BytesIO(data)) as img:
+                outputs.append(
+                    resize_image_by_width(img, target_width, reducing_gap).copy()
+                )
+        return time.perf_counter() - start, outputs
 
+    run(None)  # Warm up caches so the first timed path isn't penalized.
+    exact_seconds, exact_outputs = run(None)
     table = Table(
-        title="[bold]Matches per Target Image[/bold]",
-        title_style="none",
-        show_header=True,
+        title=f"Resize benchmark ({len(sources)} pages to {target_width}px wide)",
         header_style="bold blue",
     )
-    table.add_column("Target Image", style="cyan", no_wrap=True)
-    table.add_column("Matches", justify="right", style="magenta")
-    for target, count in target_counts.items():
-        table.add_row(target, str(count))
+    table.add_column("Path", style="cyan")
+    table.add_column("Pages/s", justify="right")
+    table.add_column("Speedup", justify="right", style="magenta")
+    table.add_column("Mean PSNR (dB)", justify="right")
+    table.add_column("Min PSNR (dB)", justify="right")
+    table.add_row("exact", f"{len(sources) / exact_seconds:.2f}", "1.00x", "-", "-")
+    for reducing_gap in gaps or [3.0, 2.0, 1.5, 1.0]:
+        seconds, outputs = run(reducing_gap)
+        scores = [_psnr(a, b) for a, b in zip(exact_outputs, outputs, strict=True)]
+        finite = [score for score in scores if math.isfinite(score)]
+        mean = f"{sum(finite) / len(finite):.1f}" if finite else "inf"
+        table.add_row(
+            f"reducing gap {reducing_gap:g}",
+            f"{len(sources) / seconds:.2f}",
+            f"{exact_seconds / seconds:.2f}x",
+            mean,
+            f"{min(scores):.1f}",
+        )
     console.print(table)
 
-    if plot:
-        # Plotting similarity values
-        console.print("\n[bold]Plotting Similarity Values[/bold]")
-        plt.clf()
-        plt.title("Max Similarity Score Distribution")
-        plt.xlabel("Cosine Similarity")
-        plt.ylabel("Frequency")
-
-        # Use the same bins for all data
-        min_sim = df["cosine_similarity"].min()
-        max_sim = df["cosine_similarity"].max()
-        bins = np.linspace(min_sim, max_sim, 30)
-
-        # Prepare data for a stacked bar chart
-        bar_labels = [f"{b:.2f}" for b in (bins[:-1] + bins[1:]) / 2]
-        bar_data = []
-        legend_labels = []
-
-        for target_name in chapter_break_images:
-            # Filter the DataFrame for rows where this target was the best match
-            subset_df = df[df["best_match_target"] == target_name]
-            # Calculate histogram for this subset
-            counts, _ = np.histogram(subset_df["cosine_similarity"], bins=bins)
-            bar_data.append(list(counts))
-            legend_labels.append(target_name)
-
-        plt.stacked_bar(bar_labels, bar_data, labels=legend_labels)
-
-        plt.show()
-        return
 
-    if len(indices) < 1:
-        console.print("[yellow]No matches found; nothing to split.[/yellow]")
+@bench_app.command("inference")
+def bench_inference(
+    input_dir: Annotated[
+        pathlib.Path,
+        typer.Argument(
+            exists=True,
+            help="Directory of page images or comic archive, as given to create-chapters.",
+        ),
+    ],
+    backends: Annotated[
+        list[str] | None,
+        typer.Option(
+            "-b",
+            "--backend",
+            help="Backend to compare against eager fp32; repeat for several. Defaults to all.",
+            autocompletion=lambda: list(INFERENCE_BACKENDS),
+        ),
+    ] = None,
+    pages: Annotated[
+        int, typer.Option("-n", "--pages", min=1, help="Maximum pages to embed.")
+    ] = 64,
+    batch_size: Annotated[int, typer.Option(min=1, help="Pages per batch.")] = 16,
+    targets: Annotated[
+        list[str] | None,
+        typer.Option(
+            "-t",
+            "--target",
+            help="Chapter break image in input_dir; repeat for several. With targets, also count pages whose match decision changes.",
+        ),
+    ] = None,
+    threshold: Annotated[
+        float, typer.Option(min=0.0, max=1.0, help="Similarity threshold for matching.")
+    ] = 0.9,
+):
+    """
+    Compare create-chapters inference backends on the CPU: pages/sec, and how far their
+    embeddings drift from the eager fp32 reference. Preprocessing is done up front and
+    not timed.
+    """
+    import numpy as np
+    import torch
+    from rich.table import Table
+
+    console = Console()
+    unknown = [name for name in backends or [] if name not in INFERENCE_BACKENDS]
+    if unknown:
+        console.print(f"[red]Unknown backends: {', '.join(unknown)}[/red]")
+        raise typer.Exit(code=1)
+    archiver = archiver_factory(input_dir)
+    if archiver is None:
+        console.print(f"[red]Unsupported file type for {input_dir.name}[/red]")
+        raise typer.Exit(code=1)
+    files = archiver.page_names()
+    # Targets are embedded alongside the sampled pages.
+    missing = [name for name in targets or [] if name not in files]
+    if missing:
+        console.print(f"[red]Target images not found: {', '.join(missing)}[/red]")
+        raise typer.Exit(code=1)
+    names = files[:pages] + [
+        name for name in targets or [] if name not in files[:pages]
+    ]
+    if not names:
+        console.print("[blue]No pages found.[/blue]")
         return
 
-    # Split chapters
-    split_points = indices[1:]
-    chapters = []
-    prev = 0
-    for pt in split_points:
-        chapters.append(files[prev:pt])
-        prev = pt
-    chapters.append(files[prev:])
-
-    # Prepare chapter data for parallel processing
-    chapter_data = [
-        (idx + 1, chap, final_output_dir, input_dir)
-        for idx, chap in enumerate(chapters)
-    ]  # Pass input_dir for zipping
-
-    # Write CBZs in parallel using ThreadPoolExecutor
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        with Progress(
-            TextColumn("[progress.description]{task.description}"),
-            BarColumn(),
-            MofNCompleteColumn(),
-            TimeRemainingColumn(),
-            console=console,
-        ) as progress_display:
-            cbz_task_id = progress_display.add_task(
-                "Creating CBZ files", total=len(chapter_data)
-            )
-            for _ in executor.map(create_chapter_zip, chapter_data):
-                progress_display.update(cbz_task_id, advance=1)
+    with console.status("Preprocessing pages..."):
+        batches = load_page_batches(archiver, names, embedding_transform(), batch_size)
+    target_rows = [names.index(name) for name in targets or []]
 
-    console.print(
-        f"[bold green]Successfully created {len(chapters)} chapters.[/bold green]"
+    def embed(backend: str) -> Tuple[float, float, "np.ndarray"]:
+        """Return (setup seconds, pages/sec, normalized embeddings) for a backend."""
+        model = load_embedding_model()
+        start = time.perf_counter()
+        runner = INFERENCE_BACKENDS[backend](model, batches[:4])
+        with torch.no_grad():
+            runner(batches[0])  # Warm-up, which is also when torch.compile compiles.
+            setup = time.perf_counter() - start
+            start = time.perf_counter()
+            outputs = [runner(batch).float() for batch in batches]
+            elapsed = time.perf_counter() - start
+        feats = torch.cat(outputs).flatten(1).numpy()
+        return (
+            setup,
+            len(names) / elapsed,
+            feats / np.linalg.norm(feats, axis=1, keepdims=True),
+        )
+
+    def matches(feats: "np.ndarray") -> "np.ndarray":
+        return (feats @ feats[target_rows].T).max(axis=1) >= threshold
+
+    with console.status("Running eager fp32 reference..."):
+        _, reference_rate, reference = embed("eager")
+
+    table = Table(
+        title=f"Inference benchmark ({len(names)} pages, batch {batch_size}, {torch.get_num_threads()} threads)",
+        header_style="bold blue",
     )
+    table.add_column("Backend", style="cyan")
+    table.add_column("Setup (s)", justify="right")
+    table.add_column("Pages/s", justify="right")
+    table.add_column("Speedup", justify="right", style="magenta")
+    table.add_column("Mean drift", justify="right")
+    table.add_column("Max drift", justify="right")
+    if target_rows:
+        table.add_column("Changed matches", justify="right")
+    for backend in backends or list(INFERENCE_BACKENDS):
+        try:
+            with console.status(f"Running {backend}..."):
+                setup, rate, feats = embed(backend)
+        except Exception as e:
+            table.add_row(backend, f"[red]failed: {e}[/red]")
+            continue
+        # Drift is the cosine distance from the reference embedding of the same page.
+        drift = 1 - np.sum(feats * reference, axis=1)
+        row = [
+            backend,
+            f"{setup:.1f}",
+            f"{rate:.1f}",
+            f"{rate / reference_rate:.2f}x",
+            f"{drift.mean():.2e}",
+            f"{drift.max():.2e}",
+        ]
+        if target_rows:
+            row.append(str(int(np.sum(matches(feats) != matches(reference)))))
+        table.add_row(*row)
+    console.print(table)
 
 
 if __name__ == "__main__":